@@ -0,0 +1,154 @@
+# batch.py — пакетная генерация договоров без Kivy.
+#
+#   python batch.py briefs.csv --template шаблон.docx --out договоры/ [--workers 4] [--profile small]
+#
+# Вход: CSV (с заголовком) или JSONL. Обязательная колонка — brief; необязательные:
+# institution, fio, vk, prepay, pages, hours, citata (1/да/true).
+# Каждая строка проходит тот же путь, что и форма в приложении:
+# analyze_brief → build_contract_values → replace_in_docx; строка, в которой нет ни
+# номера учреждения, ни числа альбомов, — ошибка, как в iter_briefs. Разбор и рендер идут
+# в пуле процессов; шаблон компилируется один раз на процесс.
+
+import argparse, csv, json, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+from contract_logic import NOT_A_BRIEF, analyze_brief, build_contract_values, looks_like_brief
+import docx_simple
+
+TRUE_WORDS = ("1", "да", "true", "yes", "+")
+
+_template_path = None
+
+
+def read_rows(path):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+
+def _init_worker(template_path):
+    global _template_path
+    _template_path = template_path
+    docx_simple.load_template(template_path)
+
+
+def row_text(row, key):
+    # текстовое поле строки; в JSON (service.py) там может оказаться число или список
+    value = row.get(key)
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        raise ValueError(f"поле {key}: ожидается строка")
+    return value
+
+
+def row_number(row, key):
+    # prepay, pages, hours: в JSON бывает и 2700, и "2700"; список или объект — ошибка
+    value = row.get(key)
+    if value is None:
+        return ""
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        raise ValueError(f"поле {key}: ожидается строка или число")
+    return str(value or "")
+
+
+def analyze_row(row):
+    # строка входа (или тело запроса service.py) → данные брифа
+    brief = row_text(row, "brief")
+    if not brief.strip():
+        raise ValueError("пустой бриф")
+    institution = row_text(row, "institution").strip()
+    data = analyze_brief(brief, None if institution in ("", "Авто") else institution)
+    if not looks_like_brief(data):
+        raise ValueError(NOT_A_BRIEF)   # как в iter_briefs: такая строка — ошибка, а не пустой договор
+    return data
+
+
+def row_values(row, data):
+    # данные брифа + поля формы из строки → значения плейсхолдеров и имя файла
+    citata = row.get("citata")
+    if not isinstance(citata, bool):
+        citata = row_number(row, "citata").strip().lower() in TRUE_WORDS
+    return build_contract_values(
+        data,
+        citata_on=citata,
+        fio=row_text(row, "fio"),
+        vk=row_text(row, "vk"),
+        prepay=row_number(row, "prepay"),
+        pages=row_number(row, "pages"),
+        hours=row_number(row, "hours"),
+    )
+
+
+def _prepare_row(row):
+    return row_values(row, analyze_row(row))
+
+
+def _render_row(path, values, profile):
+    return docx_simple.replace_in_docx(_template_path, path, values, profile=profile).unresolved
+
+
+def _unique_path(out_dir, name, taken):
+    stem, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in taken:
+        n += 1
+        candidate = f"{stem} ({n}){ext}"
+    taken.add(candidate)
+    return os.path.join(out_dir, candidate)
+
+
+def run_batch(rows, template_path, out_dir, workers=None, profile=docx_simple.DEFAULT_PROFILE):
+    """Генерирует договоры для всех строк. Возвращает (готовые пути, [(№ строки, ошибка)])."""
+    os.makedirs(out_dir, exist_ok=True)
+    done, errors, taken = [], [], set()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(template_path,)) as pool:
+        prepared = [pool.submit(_prepare_row, row) for row in rows]
+        jobs = []
+        for n, fut in enumerate(prepared, 1):
+            try:
+                values, short_name = fut.result()
+            except Exception as e:
+                errors.append((n, f"разбор: {e}"))
+                continue
+            path = _unique_path(out_dir, short_name, taken)
+            jobs.append((n, path, pool.submit(_render_row, path, values, profile)))
+        for n, path, fut in jobs:
+            try:
+                unresolved = fut.result()
+            except Exception as e:
+                errors.append((n, f"рендер: {e}"))
+                continue
+            if unresolved:
+                print(f"⚠ строка {n}: не заполнены " + ", ".join("{" + k + "}" for k in unresolved))
+            done.append(path)
+    return done, sorted(errors)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Пакетная генерация договоров из CSV/JSONL с брифами")
+    ap.add_argument("briefs", help="CSV с заголовком или JSONL; колонка brief обязательна")
+    ap.add_argument("--template", required=True, help="шаблон .docx")
+    ap.add_argument("--out", default=".", help="папка для договоров")
+    ap.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию — по ядрам)")
+    ap.add_argument("--profile", choices=sorted(docx_simple.COMPRESSION_PROFILES),
+                    default=docx_simple.DEFAULT_PROFILE, help="профиль сжатия .docx")
+    args = ap.parse_args(argv)
+
+    rows = read_rows(args.briefs)
+    t0 = time.perf_counter()
+    done, errors = run_batch(rows, args.template, args.out, args.workers, args.profile)
+    elapsed = time.perf_counter() - t0
+
+    for n, err in errors:
+        print(f"❗ строка {n}: {err}")
+    rate = len(done) / elapsed if elapsed else 0.0
+    print(f"Готово: {len(done)} из {len(rows)}, ошибок: {len(errors)}, "
+          f"{elapsed:.2f} с ({rate:.1f} договоров/с)")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
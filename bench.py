@@ -0,0 +1,276 @@
+# bench.py — замеры скорости разбора брифов и рендера .docx.
+#
+#   python bench.py                     # прогон + сравнение с bench_baseline.json (если есть)
+#   python bench.py --save-baseline     # записать текущие цифры как базовые
+#   python bench.py --save-golden       # перезаписать эталонные результаты разбора
+#
+# Корпус брифов генерируется детерминированно (seed) во всех формах, которые понимает
+# smart_brief_lines: по строке на поле, с нумерацией, одной строкой через ";" / "," /
+# пробелы и с подписями полей (8+ строк). Шаблоны .docx — синтетические, растущего
+# размера, с картинками и колонтитулами; huge — крупнее STREAM_PART_BYTES (потоковый
+# рендер). Разбор меряется с холодными кэшами строк. render_*_cold и end_to_end_cold —
+# с пустым кэшем шаблонов перед каждым вызовом: в них входит load_template (хэш,
+# компиляция, разметка членов архива). Результаты разбора сверяются с
+# bench_golden.json; падение ops/sec ниже базы больше чем на --tolerance → код 1.
+# render_huge должен быть не медленнее исходного пути (render_huge_str_replace:
+# str.replace по XML_PARTS и пересборка архива), иначе тоже код 1.
+# Для каждого профиля сжатия (profile_*) печатаются размер файла и время этапов рендера.
+
+import argparse, itertools, json, os, random, sys, tempfile, time, tracemalloc, zipfile
+
+import contract_logic
+from contract_logic import (
+    BRIEF_LABELS,
+    strict_parse_brief,
+    detect_category,
+    match_complect,
+    get_hours,
+    analyze_brief,
+    build_contract_values,
+)
+from pricing import quote_columns
+from docx_simple import replace_in_docx, clear_template_cache, load_template, COMPRESSION_PROFILES, XML_PARTS
+
+BASELINE_FILE = "bench_baseline.json"
+GOLDEN_FILE = "bench_golden.json"
+GOLDEN_SIZE = 300
+VOLATILE_KEYS = ("дата", "номер_договора")   # зависят от текущей даты
+
+_INST = ["Школа {n}", "МБОУ СОШ №{n}", "Детский сад {n}", "ДС №{n}", "Лицей {n}", "Гимназия №{n}",
+         "Прогимназия {n}", "Интернат {n}", "{n}", "сш {n}", "средняя школа {n}", "сад \"Ромашка\" {n}"]
+_GROUP = ["{g}А", "{g} Б", "{g}\"В\"", "группа {g} \"Солнышко\"", "Группа №{g} «Пчёлки»",
+          "{g} класс", "гр {g} (Звёздочки)", "{g}"]
+_PRICE = ["{p}", "{p} руб", "цена {p}", "классик", "премиум", "Планшет", "минимум", "-"]
+_PHONE = ["89991234567", "+7 999 123-45-67", "9991234567", "8 (912) 000 11 22",
+          "79001112233, 89005556677", "нет"]
+_FIO = ["Иванова Мария", "Петров П.П.", "Сидорова", ""]
+LAYOUTS = ("lines", "numbered", "semicolon", "comma", "spaces", "labelled")
+
+
+def make_brief(rng, layout):
+    n, g = rng.randint(1, 250), rng.randint(1, 11)
+    kids = rng.randint(5, 35)
+    alb = rng.randint(5, kids)
+    p = rng.choice([1600, 1700, 1900, 2000, 2100, 2300, 2600, 2700, 2800, 2900, 3100])
+    fields = [rng.choice(_INST).format(n=n), rng.choice(_GROUP).format(g=g), str(kids),
+              f"{alb} альбомов" if rng.random() < .3 else str(alb),
+              rng.choice(_PRICE).format(p=p), rng.choice(_PHONE), rng.choice(_FIO)]
+    if not fields[-1]:
+        fields.pop()
+    if layout == "lines":
+        return "\n".join(fields)
+    if layout == "numbered":
+        return "\n".join(f"{i}. {f}" for i, f in enumerate(fields, 1))
+    if layout == "semicolon":
+        return "; ".join(fields)
+    if layout == "comma":
+        return ", ".join(fields)
+    if layout == "spaces":
+        return "  ".join(fields)
+    return "\n".join(x for pair in zip(BRIEF_LABELS, fields) for x in pair)
+
+
+def make_corpus(size, seed=1):
+    rng = random.Random(seed)
+    return [make_brief(rng, LAYOUTS[i % len(LAYOUTS)]) for i in range(size)]
+
+
+def make_template(path, paragraphs, image_bytes, seed=1):
+    # минимальный .docx: document + header/footer + картинка; часть плейсхолдеров разбита на runs
+    rng = random.Random(seed)
+    body = []
+    for i in range(paragraphs):
+        if i % 10 == 0:
+            body.append('<w:p><w:r><w:t>Сумма {</w:t></w:r><w:r><w:rPr><w:b/></w:rPr>'
+                        '<w:t>общая_сумма</w:t></w:r><w:r><w:t>} руб.</w:t></w:r></w:p>')
+        else:
+            body.append(f'<w:p><w:r><w:t>Пункт {i}. Заказчик {{фамилия}}, {{учреждение}}, '
+                        f'класс {{класс}}, альбомов {{кол_альбомов}}.</w:t></w:r></w:p>')
+    w = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", '<?xml version="1.0" encoding="UTF-8"?><Types/>')
+        z.writestr("word/document.xml", f'<w:document {w}><w:body>{"".join(body)}</w:body></w:document>')
+        z.writestr("word/header1.xml", f'<w:hdr {w}><w:p><w:r><w:t>Договор № {{номер_договора}}</w:t></w:r></w:p></w:hdr>')
+        z.writestr("word/footer1.xml", f'<w:ftr {w}><w:p><w:r><w:t>{{дата}}</w:t></w:r></w:p></w:ftr>')
+        z.writestr("word/media/image1.jpeg", rng.randbytes(image_bytes), compress_type=zipfile.ZIP_STORED)
+
+
+def render_str_replace(tpl, out, values):
+    # исходный путь до CompiledTemplate: str.replace в каждой части и пересборка архива
+    with zipfile.ZipFile(tpl) as zin, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zout:
+        for info in zin.infolist():
+            data = zin.read(info)
+            if info.filename in XML_PARTS:
+                xml = data.decode("utf-8")
+                for k, v in values.items():
+                    xml = xml.replace("{" + k + "}", str(v))
+                data = xml.encode("utf-8")
+            zout.writestr(info.filename, data)
+
+
+def check_render(path, values):
+    # во всех частях результата не должно остаться {ключей}, для которых есть значение
+    with zipfile.ZipFile(path) as z:
+        for name in z.namelist():
+            if name.endswith(".xml"):
+                xml = z.read(name).decode("utf-8")
+                left = [k for k in values if "{" + k + "}" in xml]
+                if left:
+                    raise SystemExit(f"{name}: не подставлены " + ", ".join(left))
+
+
+def cold(fn):
+    # каждый вызов — с пустым кэшем скомпилированных шаблонов
+    def run():
+        clear_template_cache()
+        fn()
+    return run
+
+
+def measure(fn, min_time):
+    # ops/sec по времени без tracemalloc, затем один прогон с tracemalloc ради пика памяти
+    fn()
+    runs, t0 = 0, time.perf_counter()
+    while True:
+        fn()
+        runs += 1
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            break
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return runs / elapsed, peak
+
+
+def run(min_time, corpus_size, workdir):
+    corpus = make_corpus(corpus_size)
+    parsed = [analyze_brief(b) for b in corpus]
+    results = {}
+
+    def parse_all():
+        # холодные кэши строк и групп: иначе после прогрева меряются только попадания в lru_cache
+        contract_logic._line_token.cache_clear()
+        contract_logic._parse_group.cache_clear()
+        for b in corpus:
+            strict_parse_brief(b)
+    ops, peak = measure(parse_all, min_time)
+    results["parse"] = (ops * len(corpus), peak)
+
+    def complect_all():
+        for d in parsed:
+            cat = detect_category(d['тип_учреждения'], d['класс'], d.get('номер_группы', ''))
+            compl, _ = match_complect(d['стоимость_одного_альбома'], cat)
+            get_hours(d['кол_альбомов'], compl)
+    ops, peak = measure(complect_all, min_time)
+    results["complect_hours"] = (ops * len(parsed), peak)
+
+    # то же плюс сумма и предоплата, столбцами за один вызов
+    columns = ([d['стоимость_одного_альбома'] for d in parsed], [d['категория'] for d in parsed],
+               [d['кол_альбомов'] for d in parsed])
+    ops, peak = measure(lambda: quote_columns(*columns), min_time)
+    results["pricing_batch"] = (ops * len(parsed), peak)
+
+    values, _ = build_contract_values(parsed[0])
+    out = os.path.join(workdir, "out.docx")
+    for label, paragraphs, image in (("small", 50, 50_000), ("medium", 2_000, 1_000_000),
+                                     ("large", 20_000, 5_000_000), ("huge", 30_000, 1_000_000)):
+        tpl = os.path.join(workdir, f"{label}.docx")
+        make_template(tpl, paragraphs, image)
+        clear_template_cache()
+        if label == "huge" and not load_template(tpl).streamed:
+            raise SystemExit("render_huge: document.xml меньше STREAM_PART_BYTES, потоковый путь не замеряется")
+        render = lambda: replace_in_docx(tpl, out, values)
+        results[f"render_{label}"] = measure(render, min_time)
+        check_render(out, values)
+        results[f"render_{label}_cold"] = measure(cold(render), min_time)
+    results["render_huge_str_replace"] = measure(lambda: render_str_replace(tpl, out, values), min_time)
+
+    profiles = {}
+    for profile in COMPRESSION_PROFILES:
+        tpl = os.path.join(workdir, "large.docx")
+        results[f"profile_{profile}"] = measure(lambda: replace_in_docx(tpl, out, values, profile=profile), min_time)
+        timings = replace_in_docx(tpl, out, values, profile=profile).timings
+        profiles[profile] = (os.path.getsize(out), timings)
+
+    tpl = os.path.join(workdir, "medium.docx")
+    briefs = itertools.cycle(corpus)
+
+    def end_to_end():
+        values, name = build_contract_values(analyze_brief(next(briefs)))
+        replace_in_docx(tpl, os.path.join(workdir, name), values)
+    results["end_to_end"] = measure(end_to_end, min_time)
+    results["end_to_end_cold"] = measure(cold(end_to_end), min_time)
+    return results, profiles
+
+
+def _stable(d):
+    return {k: v for k, v in d.items() if k not in VOLATILE_KEYS}
+
+
+def check_golden(corpus, path, save):
+    if save or not os.path.exists(path):
+        golden = [{"brief": b, "parsed": _stable(strict_parse_brief(b))} for b in corpus]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(golden, f, ensure_ascii=False, indent=1)
+        print(f"Эталон разбора записан: {path} ({len(golden)} брифов)")
+        return True
+    with open(path, "r", encoding="utf-8") as f:
+        golden = json.load(f)
+    bad = [g["brief"] for g in golden if _stable(strict_parse_brief(g["brief"])) != g["parsed"]]
+    for b in bad[:5]:
+        print(f"❗ разбор отличается от эталона: {b!r}")
+    print(f"Эталон разбора: {len(golden) - len(bad)} из {len(golden)} совпадают")
+    return not bad
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Бенчмарк разбора брифов и рендера .docx")
+    ap.add_argument("--min-time", type=float, default=1.0, help="секунд на один замер")
+    ap.add_argument("--corpus", type=int, default=600, help="брифов в корпусе для замеров")
+    ap.add_argument("--baseline", default=BASELINE_FILE)
+    ap.add_argument("--golden", default=GOLDEN_FILE)
+    ap.add_argument("--tolerance", type=float, default=0.25, help="допустимое падение ops/sec (доля)")
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--save-golden", action="store_true")
+    args = ap.parse_args(argv)
+
+    ok = check_golden(make_corpus(GOLDEN_SIZE, seed=7), args.golden, args.save_golden)
+
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        results, profiles = run(args.min_time, args.corpus, workdir)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(f"{'замер':<24}{'ops/sec':>12}{'пик памяти':>14}{'база':>12}")
+    for name, (ops, peak) in results.items():
+        base = baseline.get(name)
+        mark = ""
+        if base:
+            mark = f"{(ops / base - 1) * 100:+.0f}%"
+            if ops < base * (1 - args.tolerance):
+                mark += " ❗"
+                ok = False
+        print(f"{name:<24}{ops:>12.1f}{peak / 1024:>11.0f} KB{mark:>12}")
+    if results["render_huge"][0] < results["render_huge_str_replace"][0]:
+        print("❗ render_huge медленнее исходного пути (render_huge_str_replace)")
+        ok = False
+
+    print(f"\n{'профиль':<16}{'размер':>12}  этапы рендера (large)")
+    for profile, (size, timings) in profiles.items():
+        stages = ", ".join(f"{stage} {sec * 1000:.1f} мс" for stage, sec in timings.items())
+        print(f"{profile:<16}{size / 1024:>9.0f} KB  {stages}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({k: round(v[0], 2) for k, v in results.items()}, f, indent=1)
+        print(f"База записана: {args.baseline}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,8 @@ title = Contract Generator
 package.name = contractgenerator
 package.domain = org.example
 source.dir = .
-source.include_exts = py,kv,txt,docx
+source.include_exts = py,kv,txt,docx,json
+source.exclude_patterns = bench_golden.json
 version = 0.1
 
 # критично: только pure-python зависимости
@@ -1,8 +1,14 @@
 # contract_logic.py
 # Основная логика парсинга/подсчётов (без зависимостей от python-docx).
 
+import io
 import re
 from datetime import datetime
+from collections import namedtuple
+from functools import lru_cache
+
+import pricing
+import profiling
 
 INSTITUTIONS = [
     "Школа", "Детский сад", "Лицей", "Гимназия", "Прогимназия", "Интернат"
@@ -18,21 +24,32 @@ BRIEF_LABELS = [
     "7. ФИО (если есть)"
 ]
 
-COMPLET_RANGE = [
-    ("Планшет", 1600, 1900, 2, 2, 2),
-    ("Минимум", 2000, 2300, 4, 4, 4),
-    ("Классик", 2600, 2700, 10, 10, 10),
-    ("Премиум", 2800, 2900, None, 12, 20)
-]
+# шаблоны компилируются один раз на модуль
+_NUM_RE = re.compile(r'\d+')
+_NUMBERING_RE = re.compile(r'^\s*\d+\.\s*')
+_LABEL_NUM_RE = re.compile(r'^\d+\.')
+_PHONE_RE = re.compile(r'((?:\+7|8|7)?\d{10,11})')
+_PRICE_RE = re.compile(r'(\d{3,5})')
+_GARDEN_RE = re.compile(r'\bдс\b|\bсад\b')
+_SCHOOL_RE = re.compile(r'\b(сош|сш|средняя\s*школа)\b')
+_GROUP_WORDS_RE = re.compile(r'(?i)\b(группа|группы|номер|№|no\.?)\b')
+_GROUP_WORDS_DIGITS_RE = re.compile(r'(?i)\b(группа|группы|номер|№|no\.?)\b|\d+')
+_GROUP_TITLE_RE = re.compile(r'["«](.+?)["»]')
+_CLASS_RE = re.compile(r'[0-9]+[А-Яа-яA-Za-zЁё]')
+_CLASS_FALLBACK_RE = re.compile(r'[A-Za-zА-Яа-яЁё0-9]+')
+_MULTISPACE_RE = re.compile(r'\s{2,}')
+_SEMICOLON_COMMA_RE = re.compile(r'[;,]')
+_WHITESPACE_RE = re.compile(r'\s+')
+_FIO_NOISE_RE = re.compile(r'\d+|\+7|8|7')
 
 def remove_leading_numbering(lines):
-    return [re.sub(r'^\s*\d+\.\s*', '', line).strip() for line in lines]
+    return [_NUMBERING_RE.sub('', line).strip() for line in lines]
 
 def parse_line_safe(lines, idx):
     return lines[idx] if idx < len(lines) else ""
 
 def extract_phones(line):
-    phones = re.findall(r'((?:\+7|8|7)?\d{10,11})', line.replace(' ', '').replace('-', ''))
+    phones = _PHONE_RE.findall(line.replace(' ', '').replace('-', ''))
     phones_fmt = []
     for p in phones:
         p = p.lstrip("+")
@@ -48,7 +65,7 @@ def detect_category(inst, klass, group):
     if "сад" in (inst or "").lower():
         return "ДС"
     if any(word in (inst or "").lower() for word in school_words):
-        digits = re.findall(r'\d+', klass or "")
+        digits = _NUM_RE.findall(klass or "")
         if digits:
             grade = int(digits[0])
             if 1 <= grade <= 4:
@@ -57,41 +74,15 @@ def detect_category(inst, klass, group):
                 return "СТ"
     return ""
 
+# комплекты, цены по умолчанию и часы — таблица правил pricing_rules.json (см. pricing.py)
 def match_complect(price, category):
-    try:
-        p = int(price)
-    except:
-        return None, None
-    for name, mn, mx, pages, prem_ds, prem_ml in COMPLET_RANGE:
-        if mn <= p <= mx:
-            if name == "Премиум":
-                return (name, prem_ds) if category == "ДС" else (name, prem_ml)
-            return name, pages
-    return None, None
+    return pricing.rules().complect(price, category)
 
 def get_default_price(komplekt, category):
-    if not komplekt or not category:
-        return ""
-    k = komplekt.lower()
-    if category == "МЛ":
-        if "классик" in k: return "2600"
-        if "премиум" in k: return "2800"
-        if "планшет" in k: return "1700"
-        if "минимум" in k: return "2100"
-    return ""
+    return pricing.rules().default_price(komplekt, category)
 
 def get_hours(album_count, complect):
-    try:
-        n = int(album_count)
-    except:
-        return ""
-    if complect == "Планшет":
-        return 1 if n <= 20 else 2 if n <= 39 else 3
-    if complect == "Минимум":
-        return 1 if n < 18 else 2 if n <= 28 else 3
-    if complect in ("Классик", "Премиум"):
-        return 1 if n < 18 else 2 if n <= 25 else 3
-    return ""
+    return pricing.rules().hours(album_count, complect)
 
 def round_down_to_thousand(num):
     try:
@@ -101,108 +92,132 @@ def round_down_to_thousand(num):
 
 def clean_group_title(title):
     t = (title or "").strip()
-    t = re.sub(r'(?i)\b(группа|группы|номер|№|no\.?)\b', '', t)
-    t = re.sub(r'\d+', '', t)
+    t = _GROUP_WORDS_RE.sub('', t)
+    t = _NUM_RE.sub('', t)
     t = t.replace('"', '').replace("«", '').replace("»", '').replace("'", '')
     t = t.replace("(", '').replace(")", '')
-    t = re.sub(r'\s{2,}', ' ', t).strip()
+    t = _MULTISPACE_RE.sub(' ', t).strip()
     return t[0].upper() + t[1:] if t else ""
 
+SKIP_WORDS = ('номер','школ','сад','учреждение','группа','класс',
+              'количество','всего','альбом','вид','цена','стоимость',
+              'телефон','ответств','фио','название')
+
+# вид токена по позиции строки в брифе — в порядке BRIEF_LABELS
+TOKEN_KINDS = ("institution", "class", "children", "albums", "price", "phone", "name")
+
+# Строка брифа, разобранная один раз: всё, что из неё может понадобиться.
+# kind проставляет tokenize_brief по позиции строки ("extra" — сверх седьмой).
+LineToken = namedtuple("LineToken", "kind text lower is_label institution number "
+                                    "only_digits price price_lower phones fio")
+
+# разбор идёт на каждое нажатие клавиши: токены строк и разобранные поля
+# кэшируются, после правки пересчитываются только затронутые строки/поля
+LINE_CACHE_SIZE = 2048
+
+@lru_cache(maxsize=LINE_CACHE_SIZE)
+def _line_token(line):
+    text = _NUMBERING_RE.sub('', line.strip()).strip()
+    lwr = text.lower()
+    num = _NUM_RE.search(text)
+    num = num.group(0) if num else ""
+    if _GARDEN_RE.search(lwr):
+        institution = "Детский сад"
+    elif _SCHOOL_RE.search(lwr):
+        institution = "Школа"
+    else:
+        institution = next((ins for ins in INSTITUTIONS if ins.lower() in lwr), "")
+    price_str = text.replace(' ', '')
+    price = _PRICE_RE.search(price_str)
+    return LineToken(
+        kind="",
+        text=text,
+        lower=lwr,
+        is_label=any(w in lwr for w in SKIP_WORDS) or bool(_LABEL_NUM_RE.match(lwr)),
+        institution=institution,
+        number=num,
+        only_digits=bool(_NUM_RE.fullmatch(text)),
+        price=price.group(1) if price else "",
+        price_lower=price_str.lower(),
+        phones=tuple(extract_phones(text)),
+        fio=_FIO_NOISE_RE.sub('', text).strip(", ."),
+    )
+
+_EMPTY_TOKEN = _line_token("")
+
+def _split_single_line(line):
+    parts = _SEMICOLON_COMMA_RE.split(line)
+    if len(parts) < 6: parts = _MULTISPACE_RE.split(line)
+    if len(parts) < 6: parts = _WHITESPACE_RE.split(line)
+    return [p.strip() for p in parts if p.strip()]
+
+def tokenize_brief(brief):
+    """Бриф → список LineToken: один проход по строкам, каждая строка разбирается один раз."""
+    tokens = [_line_token(l) for l in (brief or "").strip().split('\n') if l.strip()]
+    if len(tokens) == 1:
+        # всё в одну строку: "Школа 5; 3А; 25; 20; 2600; 8999…"
+        tokens = [_line_token(p) for p in _split_single_line(tokens[0].text)]
+    if len(tokens) > 7:
+        # бриф с подписями ("1. Учреждение", "Телефон"…): подписи выкидываем, если остаётся 5–8 строк
+        filtered = [t for t in tokens if not t.is_label]
+        if 5 <= len(filtered) <= 8:
+            tokens = filtered
+    return [t._replace(kind=TOKEN_KINDS[i] if i < len(TOKEN_KINDS) else "extra")
+            for i, t in enumerate(tokens)]
+
 def smart_brief_lines(brief):
-    lines = [l.strip() for l in (brief or "").strip().split('\n') if l.strip()]
-    lines = remove_leading_numbering(lines)
-    if len(lines) == 1:
-        parts = re.split(r'[;,]', lines[0])
-        if len(parts) < 6: parts = re.split(r'\s{2,}', lines[0])
-        if len(parts) < 6: parts = re.split(r'\s+', lines[0])
-        lines = remove_leading_numbering([p.strip() for p in parts if p.strip()])
-    if len(lines) > 7:
-        skip = ['номер','школ','сад','учреждение','группа','класс',
-                'количество','всего','альбом','вид','цена','стоимость',
-                'телефон','ответств','фио','название']
-        result, prev = [], False
-        for line in lines:
-            lwr = line.lower()
-            if any(w in lwr for w in skip) or re.match(r'^\d+\.', lwr):
-                prev = True; continue
-            if prev or (not any(w in lwr for w in skip) and not re.match(r'^\d+\.', lwr)):
-                result.append(line); prev = False
-        if 5 <= len(result) <= 8:
-            lines = result
-        else:
-            lines2 = [line for line in lines if not (any(w in line.lower() for w in skip) or re.match(r'^\d+\.', line.lower()))]
-            if 5 <= len(lines2) <= 8: lines = lines2
-    return lines
+    return [t.text for t in tokenize_brief(brief)]
 
-def strict_parse_brief(brief, user_institution=None):
-    lines = smart_brief_lines(brief)
-    data, found = {'_lines': lines}, False
+def _token_at(tokens, idx):
+    return tokens[idx] if idx < len(tokens) else _EMPTY_TOKEN
 
+def _parse_institution(head, user_institution):
     # 1–3: поиск типа учреждения и номера
-    for line in lines[:3]:
-        lwr = line.lower()
-        if re.search(r'\bдс\b', lwr) or re.search(r'\bсад\b', lwr):
-            num = re.search(r'(\d+)', line)
-            data['тип_учреждения'] = "Детский сад"
-            data['номер_учреждения'] = num.group(1) if num else ""
-            found = True; break
-        if re.search(r'\b(сош|сш|средняя\s*школа)\b', lwr):
-            num = re.search(r'(\d+)', line)
-            data['тип_учреждения'] = "Школа"
-            data['номер_учреждения'] = num.group(1) if num else ""
-            found = True; break
-        for ins in INSTITUTIONS:
-            if ins.lower() in lwr:
-                num = re.search(r'(\d+)', line)
-                data['тип_учреждения'] = ins
-                data['номер_учреждения'] = num.group(1) if num else ""
-                found = True; break
-        if found: break
-
-    if not found:
-        if lines and re.fullmatch(r'\d+', lines[0]):
-            data['тип_учреждения'] = user_institution or "Школа"
-            data['номер_учреждения'] = lines[0]
-        elif user_institution:
-            num = re.search(r'(\d+)', lines[0]) if lines else None
-            data['тип_учреждения'] = user_institution
-            data['номер_учреждения'] = num.group(1) if num else ""
-        else:
-            data['тип_учреждения'] = ""
-            data['номер_учреждения'] = ""
-
-    # класс/группа
-    group_line = parse_line_safe(lines, 1)
-    m = re.search(r'(\d+)', group_line)
-    group = m.group(1) if m else ""
-    title_match = re.search(r'["«](.+?)["»]', group_line)
-    title = clean_group_title(title_match.group(1) if title_match else re.sub(r'(?i)\b(группа|группы|номер|№|no\.?)\b|\d+', '', group_line))
-
-    if data.get('тип_учреждения') and "сад" in data['тип_учреждения'].lower():
-        data['класс'] = f'Группа {group} "{title}"' if title else f'Группа {group}'
-        data['номер_группы'] = group
-        data['название_группы'] = title
-    else:
-        kls = ''.join(re.findall(r'[0-9]+[А-Яа-яA-Za-zЁё]', group_line.replace(' ', '').replace('"', '')))
-        if not kls:
-            kls = ''.join(re.findall(r'[A-Za-zА-Яа-яЁё0-9]+', group_line.replace(' ', '').replace('"', '')))
-        data['класс'] = kls
-        digits_list = re.findall(r'\d+', kls)
-        data['номер_класса'] = digits_list[0] if kls and digits_list else ""
-
-    digits = re.findall(r'\d+', parse_line_safe(lines, 2))
-    data['кол_детей'] = digits[0] if digits else ""
-    digits = re.findall(r'\d+', parse_line_safe(lines, 3))
-    data['кол_альбомов'] = digits[0] if digits else ""
-    price_str = parse_line_safe(lines, 4).replace(' ', '')
-    price = re.search(r'(\d{3,5})', price_str)
-    data['стоимость_одного_альбома'] = price.group(1) if price else ""
+    for tok in head:
+        if tok.institution:
+            return tok.institution, tok.number
+    if head and head[0].only_digits:
+        return user_institution or "Школа", head[0].text
+    if user_institution:
+        return user_institution, head[0].number if head else ""
+    return "", ""
+
+@lru_cache(maxsize=LINE_CACHE_SIZE)
+def _parse_group(group_line, is_garden):
+    # класс/группа → пары (ключ, значение)
+    m = _NUM_RE.search(group_line)
+    group = m.group(0) if m else ""
+    if is_garden:
+        title_match = _GROUP_TITLE_RE.search(group_line)
+        title = clean_group_title(title_match.group(1) if title_match else _GROUP_WORDS_DIGITS_RE.sub('', group_line))
+        return (('класс', f'Группа {group} "{title}"' if title else f'Группа {group}'),
+                ('номер_группы', group),
+                ('название_группы', title))
+    compact = group_line.replace(' ', '').replace('"', '')
+    kls = ''.join(_CLASS_RE.findall(compact)) or ''.join(_CLASS_FALLBACK_RE.findall(compact))
+    digits_list = _NUM_RE.findall(kls)
+    return (('класс', kls),
+            ('номер_класса', digits_list[0] if kls and digits_list else ""))
+
+def strict_parse_brief(brief, user_institution=None):
+    tokens = tokenize_brief(brief)
+    data = {'_lines': [t.text for t in tokens]}
+
+    data['тип_учреждения'], data['номер_учреждения'] = _parse_institution(tokens[:3], user_institution)
+
+    is_garden = "сад" in data['тип_учреждения'].lower()
+    data.update(_parse_group(_token_at(tokens, 1).text, is_garden))
+
+    data['кол_детей'] = _token_at(tokens, 2).number
+    data['кол_альбомов'] = _token_at(tokens, 3).number
+    price_tok = _token_at(tokens, 4)
+    data['стоимость_одного_альбома'] = price_tok.price
 
     # автоцена по комплекту, если цена не указана
-    komplekt = ""
     if not data['стоимость_одного_альбома']:
+        komplekt = ""
         for k in ["классик", "премиум", "планшет", "минимум"]:
-            if k in price_str.lower():
+            if k in price_tok.price_lower:
                 komplekt = k.capitalize()
                 break
         data['стоимость_одного_альбома'] = get_default_price(
@@ -211,13 +226,12 @@ def strict_parse_brief(brief, user_institution=None):
         )
         data['комплект'] = komplekt
 
-    tel_line = parse_line_safe(lines, 5)
     all_phones = []
-    for l in lines:
-        all_phones += extract_phones(l)
+    for t in tokens:
+        all_phones += t.phones
     data['телефон'] = ", ".join(all_phones)
-    fio = lines[6].strip() if len(lines) >= 7 and lines[6].strip() else re.sub(r'\d+|\+7|8|7', '', tel_line).strip(", .")
-    data['фамилия'] = fio
+    name_tok = _token_at(tokens, 6)
+    data['фамилия'] = name_tok.text if name_tok.text else _token_at(tokens, 5).fio
 
     if (data.get('тип_учреждения','').lower() in ['школа','лицей','гимназия','прогимназия','интернат']):
         data['когдасъёмка'] = "Съёмка в студии проходит в будние дни."
@@ -230,3 +244,249 @@ def strict_parse_brief(brief, user_institution=None):
     data['номер_договора'] = datetime.now().strftime("%d%m%y")
     data['класс_for_file'] = (data['класс'].replace("Группа", "").replace('"','').replace("«",'').replace("»",'').replace("'",'').strip().upper() if data.get('класс') else "")
     return data
+
+def analyze_brief(brief, user_institution=None):
+    # разбор брифа + категория, комплект, страницы и часы (то, что показывает превью)
+    with profiling.stage("parse") as ps:
+        ps.add(read=len(brief))
+        data = strict_parse_brief(brief, user_institution)
+    with profiling.stage("pricing"):
+        category = detect_category(data.get('тип_учреждения', ''), data.get('класс', ''), data.get('номер_группы', ''))
+        data['категория'] = category
+        complect, pages = match_complect(data.get('стоимость_одного_альбома',''), category)
+        data['комплект'] = complect or ''
+        data['страницы_комплекта'] = pages or ''
+        data['часы'] = get_hours(data.get('кол_альбомов',''), complect) if complect else ''
+    return data
+
+# несколько брифов подряд (выгрузка чата, файл): границы — по строке с учреждением
+# и номером или по "1." в начале строки, а также по пустой строке после полного брифа
+MIN_BRIEF_LINES = 3
+MAX_BRIEF_LINES = 32
+_BRIEF_START_NUM_RE = re.compile(r'^\s*1\.')
+_LABEL_TEXTS = frozenset(_NUMBERING_RE.sub('', l).lower() for l in BRIEF_LABELS)
+
+# № по порядку, № строки начала во входе, текст брифа, данные analyze_brief или None, ошибка или ""
+BriefRecord = namedtuple("BriefRecord", "index line text data error")
+
+def _is_brief_start(line):
+    if _BRIEF_START_NUM_RE.match(line):
+        return True
+    tok = _line_token(line)
+    return bool(tok.institution and tok.number)
+
+def _is_whole_brief(line):
+    # бриф в одну строку: "Школа 5; 3А; 25; 20; 2600; 8999…"
+    parts = _split_single_line(line.strip())
+    if len(parts) < 6:
+        return False
+    tok = _line_token(parts[0])
+    return bool(tok.institution or tok.only_digits)
+
+def split_briefs(source):
+    """Строки входа → (№ строки начала, текст брифа), лениво.
+
+    source — строка, файл или любой итератор строк; в памяти только текущий бриф.
+    Пустая строка после брифа с подписями закрывает его, только если дальше идёт
+    не следующая подпись того же брифа ("6. Телефон")."""
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    cur, start, labelled, pending, has_start = [], 0, False, False, False
+    for n, line in enumerate(source, 1):
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            pending = pending or len(cur) >= (MIN_BRIEF_LINES if labelled else 6)
+            continue
+        is_label = _line_token(line).lower in _LABEL_TEXTS
+        whole = _is_whole_brief(line)
+        starts = _is_brief_start(line)
+        if cur and (whole or len(cur) >= MAX_BRIEF_LINES
+                    or (pending and (starts or not (labelled and is_label)))
+                    or (starts and (len(cur) >= MIN_BRIEF_LINES or not has_start))):
+            # текст перед первым брифом ("вот заявки:") уходит отдельной записью
+            yield start, "\n".join(cur)
+            cur, labelled, has_start = [], False, False
+        pending = False
+        if whole:
+            yield n, line
+            continue
+        if not cur:
+            start = n
+        cur.append(line)
+        labelled = labelled or is_label
+        has_start = has_start or starts
+    if cur:
+        yield start, "\n".join(cur)
+
+NOT_A_BRIEF = "не похоже на бриф: нет номера учреждения и числа альбомов"
+
+def looks_like_brief(data):
+    # разобранный текст без номера учреждения и без числа альбомов — не бриф (болтовня, подпись)
+    return bool(data.get('номер_учреждения') or data.get('кол_альбомов'))
+
+def iter_briefs(source, user_institution=None):
+    """Разбор нескольких брифов подряд: BriefRecord на каждый, по мере чтения входа.
+
+    Ошибка в одном брифе не останавливает разбор: она попадает в BriefRecord.error."""
+    for index, (line, text) in enumerate(split_briefs(source), 1):
+        try:
+            data = analyze_brief(text, user_institution)
+        except Exception as e:
+            yield BriefRecord(index, line, text, None, f"ошибка разбора: {e}")
+            continue
+        if not looks_like_brief(data):
+            yield BriefRecord(index, line, text, None, NOT_A_BRIEF)
+            continue
+        yield BriefRecord(index, line, text, data, "")
+
+class IncrementalBriefParser:
+    """Разбор брифа при наборе текста.
+
+    Тот же текст повторно не разбирается; для изменённого текста кэши строк и полей
+    (_line_token, _parse_group) отдают всё, кроме затронутого правкой.
+    """
+
+    def __init__(self):
+        self._key = None
+        self._data = None
+
+    def parse(self, brief, user_institution=None):
+        key = (brief or "", user_institution)
+        if key != self._key:
+            self._data = analyze_brief(brief, user_institution)
+            self._key = key
+        return dict(self._data)
+
+def _to_int(value):
+    try:
+        return int(value or 0)
+    except:
+        return 0
+
+def contract_file_name(d, base_price):
+    klass_for_file = d.get('номер_группы','') if d.get('категория','') == "ДС" else d.get('класс_for_file','')
+    name = f"{d.get('номер_учреждения','')} {klass_for_file} {d.get('кол_альбомов','')} {base_price}.docx" \
+        .replace('  ', ' ').replace('""','').replace(' .','.').replace('..','.')
+    return name.upper()
+
+class Quote:
+    """Расчёт договора: brief_data + поля формы → цены, предоплата, страницы, имя файла.
+
+    Неизменяемый. evolve() возвращает новый расчёт, в котором пересчитаны только поля,
+    чьи входы изменились (см. DEPENDS); если не изменилось ничего — возвращает self.
+    """
+
+    INPUTS = ("data", "citata_on", "fio", "vk", "prepay", "pages", "hours", "date_text")
+    # поле → от чего зависит; порядок — порядок вычисления
+    DEPENDS = {
+        "base_price": ("data",),
+        "price": ("base_price", "citata_on"),
+        "albums": ("data",),
+        "total": ("price", "albums"),
+        "prepay_value": ("total", "prepay"),
+        "rest": ("total", "prepay_value"),
+        "pages_value": ("data", "pages"),
+        "hours_value": ("data", "hours"),
+        "fio_value": ("data", "fio"),
+        "file_name": ("data", "base_price"),
+    }
+    __slots__ = INPUTS + tuple(DEPENDS)
+
+    def __init__(self, data=None, citata_on=False, fio="", vk="", prepay="", pages="", hours="", date_text=""):
+        inputs = (dict(data or {}), bool(citata_on), fio or "", vk or "", prepay or "",
+                  pages or "", hours or "", date_text or "")
+        for name, value in zip(self.INPUTS, inputs):
+            object.__setattr__(self, name, value)
+        for name in self.DEPENDS:
+            object.__setattr__(self, name, getattr(self, "_calc_" + name)())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Quote неизменяем — используйте evolve()")
+
+    def evolve(self, **changes):
+        changed = {k for k, v in changes.items() if getattr(self, k) != v}
+        if not changed:
+            return self
+        new = object.__new__(Quote)
+        for name in self.__slots__:
+            object.__setattr__(new, name, getattr(self, name))
+        for name in changed:
+            value = changes[name]
+            if name == "data":
+                value = dict(value or {})
+            elif name == "citata_on":
+                value = bool(value)
+            else:
+                value = value or ""
+            object.__setattr__(new, name, value)
+        for name, deps in self.DEPENDS.items():
+            if changed.intersection(deps):
+                value = getattr(new, "_calc_" + name)()
+                if value != getattr(self, name):
+                    object.__setattr__(new, name, value)
+                    changed.add(name)
+        return new
+
+    def _calc_base_price(self):
+        return _to_int(self.data.get('стоимость_одного_альбома',''))
+
+    def _calc_price(self):
+        # надбавка за цитаты
+        return pricing.rules().price(self.base_price, self.citata_on)
+
+    def _calc_albums(self):
+        return _to_int(self.data.get('кол_альбомов', 0))
+
+    def _calc_total(self):
+        return self.price * self.albums
+
+    def _calc_prepay_value(self):
+        # по умолчанию доля от суммы с округлением вниз (30% до тысячи)
+        return pricing.rules().prepay(self.total, self.prepay)
+
+    def _calc_rest(self):
+        return self.total - self.prepay_value
+
+    def _calc_pages_value(self):
+        return self.pages or (self.data.get('страницы_комплекта') or "")
+
+    def _calc_hours_value(self):
+        return self.hours or (self.data.get('часы') or "")
+
+    def _calc_fio_value(self):
+        return self.fio or self.data.get('фамилия','')
+
+    def _calc_file_name(self):
+        return contract_file_name(self.data, self.base_price)
+
+    def values(self):
+        # значения плейсхолдеров шаблона договора
+        d = self.data
+        return {
+            "учреждение": f"{d.get('тип_учреждения','')} №{d.get('номер_учреждения','')}".strip(),
+            "класс": d.get("класс", ""),
+            "кол_детей": d.get("кол_детей", ""),
+            "кол_альбомов": d.get("кол_альбомов", ""),
+            "стоимость_одного_альбома": self.base_price,
+            "общая_сумма": self.total,
+            "предоплата": self.prepay_value,
+            "остаток": self.rest,
+            "фамилия": self.fio_value,
+            "телефон": d.get("телефон", ""),
+            "ссылка_ВК": self.vk,
+            "кол_страниц": self.pages_value,
+            "колвочасов": self.hours_value,
+            "дата": self.date_text or d.get('дата', ''),
+            "номер_договора": d.get("номер_договора", ""),
+            "когдасъёмка": d.get("когдасъёмка", ""),
+            "ц": ", Цитаты" if self.citata_on else ""
+        }
+
+# все ключи, которые договор подставляет в шаблон
+CONTRACT_KEYS = tuple(Quote().values())
+
+def build_contract_values(d, citata_on=False, fio="", vk="", prepay="", pages="", hours="", date_text=""):
+    # значения плейсхолдеров шаблона договора + короткое имя файла
+    with profiling.stage("quote"):
+        q = Quote(d, citata_on, fio, vk, prepay, pages, hours, date_text)
+        return q.values(), q.file_name
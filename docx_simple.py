@@ -1,8 +1,33 @@
 # docx_simple.py
 # Простая замена плейсхолдеров {ключ} в .docx без python-docx/lxml.
-# ВАЖНО: плейсхолдеры в шаблоне должны быть цельной строкой (не разбиты форматированием).
+# Плейсхолдеры, которые Word разбил на несколько <w:r> (форматирование, проверка
+# орфографии), перед разбором склеиваются обратно в первый фрагмент (_heal_runs).
+#
+# Шаблон разбирается один раз (CompiledTemplate): части XML заранее режутся на
+# литералы и {ключи}, рендер — это склейка сегментов и запись архива.
+# Части с текстом ищутся по [Content_Types].xml и связям документа (discover_parts),
+# плюс стандартные document/header/footer из XML_PARTS; рендер трогает только части с плейсхолдерами.
+# Скомпилированные шаблоны лежат в LRU-кэше по пути + mtime + хэшу содержимого.
+# Члены архива без плейсхолдеров (картинки, шрифты, стили) в кэше не держатся: при
+# рендере они копируются из файла шаблона как есть, в сжатом виде; заново сжимаются
+# только переписанные части.
+# Результат пишется во временный файл рядом с целевым и атомарно переименовывается.
+# OutputCache хранит уже собранные договоры: повторный запрос с тем же шаблоном и
+# теми же значениями отдаётся копией файла без рендера.
+# Профиль сжатия (COMPRESSION_PROFILES) выбирает уровень deflate. Крупные части,
+# и переписанные целиком, и потоковые, режутся на блоки COMPRESS_BLOCK; блоки сжимаются
+# параллельно в пуле потоков (zlib отпускает GIL) и склеиваются через Z_SYNC_FLUSH, как в pigz.
+# render_set — одни значения в несколько шаблонов сразу (договор, счёт, акт…).
 
-import zipfile, shutil, os, tempfile
+import zipfile, os, re, hashlib, threading, struct, tempfile, zlib, json, shutil, posixpath, codecs, time
+from array import array
+from collections import OrderedDict, deque
+from itertools import accumulate
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+
+import profiling
 
 XML_PARTS = (
     "word/document.xml",
@@ -10,38 +35,935 @@ XML_PARTS = (
     "word/footer1.xml", "word/footer2.xml", "word/footer3.xml",
 )
 
-def replace_in_docx(template_path: str, out_path: str, values: dict):
-    # копируем шаблон → выходной .docx
-    shutil.copyfile(template_path, out_path)
+TEMPLATE_CACHE_SIZE = 8
+OUTPUT_CACHE_BYTES = 50 * 1024 * 1024
+# части XML крупнее порога подставляются потоково, с ограниченной памятью
+STREAM_PART_BYTES = 4 * 1024 * 1024
+STREAM_CHUNK = 64 * 1024
+STREAM_CARRY_LIMIT = 1024 * 1024
+
+# профиль → (уровень deflate для переписанных частей, пережимать ли нетронутые члены)
+COMPRESSION_PROFILES = {
+    "fast": (1, False),       # быстро отправить
+    "balanced": (6, False),
+    "small": (9, True),       # мессенджеры с лимитом на размер
+}
+DEFAULT_PROFILE = "balanced"
+COMPRESS_WORKERS = min(4, os.cpu_count() or 1)
+COMPRESS_PARALLEL_BYTES = 256 * 1024   # меньше — сжимаем в текущем потоке, пул дороже
+COMPRESS_BLOCK = 128 * 1024
+_DEFLATE_WINDOW = 32 * 1024            # словарь блока — хвост предыдущего, сжатие почти не хуже
+_DEFLATE_END = zlib.compressobj(6, zlib.DEFLATED, -15).flush()   # пустой последний блок
+RENDER_SET_WORKERS = min(4, os.cpu_count() or 1)
+
+_PLACEHOLDER_RE = re.compile(r'\{([^{}<>\s]+)\}')
+_TAG_SPLIT_RE = re.compile(r'(<[^>]*>)')
+_RUN_TEXT_RE = re.compile(r'<w:t(?:\s[^>]*)?>$')
+MAX_KEY_LEN = 100
+
+_OVERRIDE_RE = re.compile(r'<Override\b[^>]*>')
+_RELATIONSHIP_RE = re.compile(r'<Relationship\b[^>]*>')
+_ATTR_RE = re.compile(r'(\w+)="([^"]*)"')
+_TEXT_CONTENT_TYPE_RE = re.compile(
+    r'wordprocessingml\.(?:document\.main|template\.main|header|footer|footnotes|endnotes|comments)\+xml'
+    r'|ms-word\.(?:document|template)\.macroEnabled(?:\.main)?\+xml')
+_TEXT_REL_TYPES = ("/header", "/footer", "/footnotes", "/endnotes", "/comments")
+
+_cache = OrderedDict()   # (путь, mtime_ns, sha1) → CompiledTemplate
+_digests = {}            # путь → (mtime_ns, размер, sha1), чтобы не хэшировать файл повторно
+_cache_lock = threading.Lock()
+_compress_pool = None
+_render_pool = None   # отдельно от _compress_pool: рендер сам ждёт задач сжатия
+_compress_pool_lock = threading.Lock()
 
-    tmpdir = tempfile.mkdtemp(prefix="docx_")
+
+def _read_umask():
+    # umask процесса без os.umask(): тот меняет его для всех потоков, пусть и ненадолго.
+    # /proc/self/status есть на Linux и Android; иначе None — права mkstemp не трогаем
     try:
-        # распаковать docx как zip
-        with zipfile.ZipFile(out_path, 'r') as zin:
-            zin.extractall(tmpdir)
-
-        # заменить плейсхолдеры в основных частях
-        for rel in XML_PARTS:
-            p = os.path.join(tmpdir, rel)
-            if not os.path.exists(p):
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+_UMASK = _read_umask()
+
+
+class CompiledTemplate:
+    """Шаблон .docx, разобранный один раз: члены архива, нарезанные части XML
+    и индекс плейсхолдеров (ключ → [(часть, смещение в XML)]).
+
+    Сжатые данные членов (картинки, шрифты) в кэше не лежат: хранится только, где
+    они начинаются в файле шаблона, и при рендере они копируются оттуда кусками.
+    Если файл шаблона поменялся после компиляции, рендер бросает TemplateChanged.
+
+    Части крупнее STREAM_PART_BYTES в памяти не держатся: при рендере они читаются
+    из файла шаблона кусками и сразу пишутся в выходной архив. Для них при компиляции
+    запоминается план (_stream_plan): где в распакованных байтах куски с плейсхолдерами
+    и какие срезы этих байт чередуются с ключами. Рендер только вставляет значения,
+    не разбирая XML заново; куски без плейсхолдеров копируются как есть.
+    """
+
+    __slots__ = ("path", "digest", "stat", "members", "parts", "streamed", "xml_parts", "index")
+
+    def __init__(self, path, digest, stage=None):
+        # stage — замер profiling, в него пишется, сколько байт шаблона прочитано
+        self.path = path
+        self.digest = digest
+        self.members = []    # [(ZipInfo, начало сжатых данных в файле шаблона)]
+        self.parts = {}      # часть с плейсхолдерами → сегменты: чётные — литералы, нечётные — ключи
+        self.streamed = {}   # крупная часть → план подстановки, пустой — плейсхолдеров нет
+        self.index = {}
+        f = _CountingReader(open(path, "rb"))
+        with f, zipfile.ZipFile(f) as zin:
+            self.stat = _file_stat(f)
+            self.xml_parts = discover_parts(zin)
+            for info in zin.infolist():
+                if info.is_dir():
+                    continue
+                is_text = info.filename in self.xml_parts
+                if is_text and info.file_size > STREAM_PART_BYTES:
+                    with zin.open(info) as part:
+                        self.streamed[info.filename], offsets = _stream_plan(part)
+                    self.members.append((info, _member_data_offset(f, info)))
+                else:
+                    self.members.append((info, _member_data_offset(f, info)))
+                    if not is_text:
+                        continue
+                    segs, offsets = split_placeholders(zin.read(info).decode("utf-8"))
+                    if offsets:
+                        self.parts[info.filename] = segs
+                for key, offset in offsets:
+                    self.index.setdefault(key, []).append((info.filename, offset))
+        if stage is not None:
+            stage.add(read=f.count)
+
+    def keys(self):
+        return set(self.index)
+
+    def render(self, out_path, values, progress=None, cancel=None, profile=DEFAULT_PROFILE):
+        """Пишет договор в out_path.
+
+        progress(этап, сделано, всего) вызывается на этапах "substitute" и "pack";
+        cancel — threading.Event, при установке рендер прерывается с RenderCancelled;
+        profile — ключ COMPRESSION_PROFILES.
+        """
+        level, recompress = _profile(profile)
+        timings = {}
+        t0 = time.perf_counter()
+        unresolved = set()
+        payloads = {}
+        with profiling.stage("substitute") as ps:
+            for n, (name, segs) in enumerate(self.parts.items()):
+                _check_cancel(cancel)
+                payloads[name] = _join_segments(segs, values, unresolved).encode("utf-8")
+                ps.add(written=len(payloads[name]))
+                if progress:
+                    progress("substitute", n + 1, len(self.parts))
+        timings["substitute"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with profiling.stage("compress") as ps:
+            _check_cancel(cancel)
+            packed = {name: _deflate(p, level) for name, p in payloads.items()}
+            ps.add(read=sum(map(len, payloads.values())), written=sum(len(p[0]) for p in packed.values()))
+        timings["compress"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with profiling.stage("pack") as ps, ExitStack() as stack:
+            src = stack.enter_context(open(self.path, "rb"))
+            if _file_stat(src) != self.stat:
+                raise TemplateChanged(self.path)
+            zin = stack.enter_context(zipfile.ZipFile(src)) if self.streamed else None
+            f = stack.enter_context(_atomic_output(out_path))
+            zout = _ZipWriter(f, level)
+            for n, (info, offset) in enumerate(self.members):
+                _check_cancel(cancel)
+                if info.filename in packed:
+                    zout.write_deflated(info, *packed[info.filename])
+                elif self.streamed.get(info.filename):
+                    with zin.open(info) as part:
+                        zout.write_stream(info, _splice_stream(
+                            part, self.streamed[info.filename], values, unresolved, cancel))
+                elif recompress and info.compress_type == zipfile.ZIP_DEFLATED:
+                    # пережатие на level по одному члену и кусками, без распаковки всего сразу
+                    zout.write_stream(info, _inflate(_iter_raw(src, info, offset)))
+                else:
+                    zout.write_raw(info, _iter_raw(src, info, offset))
+                if progress:
+                    progress("pack", n + 1, len(self.members))
+            zout.close()
+            ps.add(written=f.tell())
+        timings["pack"] = time.perf_counter() - t0
+        return RenderResult(out_path, sorted(unresolved), profile=profile, timings=timings)
+
+
+def _profile(profile):
+    try:
+        return COMPRESSION_PROFILES[profile]
+    except KeyError:
+        raise ValueError(f"Неизвестный профиль сжатия: {profile!r}") from None
+
+
+def _deflate(payload, level):
+    return b"".join(_deflate_iter((payload,), level)), zlib.crc32(payload), len(payload)
+
+
+def _deflate_iter(payloads, level):
+    """Сжатые данные (deflate без заголовка) для потока кусков, по мере готовности.
+
+    Поток до COMPRESS_PARALLEL_BYTES сжимается в текущем потоке. Крупный режется
+    на блоки COMPRESS_BLOCK, они сжимаются в пуле (не больше 2×COMPRESS_WORKERS
+    сразу, память ограничена) и отдаются по порядку. Каждый блок кончается
+    Z_SYNC_FLUSH, словарь блока — хвост предыдущего; в конце — пустой последний блок.
+    """
+    blocks = _blocks(payloads)
+    head, total = [], 0
+    for block in blocks:
+        head.append(block)
+        total += len(block)
+        if total >= COMPRESS_PARALLEL_BYTES:
+            break
+    if total < COMPRESS_PARALLEL_BYTES or COMPRESS_WORKERS < 2:
+        co = zlib.compressobj(level, zlib.DEFLATED, -15)
+        for source in (head, blocks):
+            for block in source:
+                out = co.compress(block)
+                if out:
+                    yield out
+        yield co.flush()
+        return
+    pool = _get_compress_pool()
+    running, tail = deque(), b""
+    for source in (head, blocks):
+        for block in source:
+            running.append(pool.submit(_deflate_block, block, tail, level))
+            tail = (tail + block)[-_DEFLATE_WINDOW:] if len(block) < _DEFLATE_WINDOW else block[-_DEFLATE_WINDOW:]
+            if len(running) > 2 * COMPRESS_WORKERS:
+                yield running.popleft().result()
+    while running:
+        yield running.popleft().result()
+    yield _DEFLATE_END
+
+
+def _deflate_block(block, zdict, level):
+    if zdict:
+        co = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        co = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return co.compress(block) + co.flush(zlib.Z_SYNC_FLUSH)
+
+
+def _blocks(payloads):
+    # куски любого размера → блоки по COMPRESS_BLOCK (последний короче)
+    buf = bytearray()
+    for payload in payloads:
+        if not buf and len(payload) >= COMPRESS_BLOCK:
+            whole = len(payload) - len(payload) % COMPRESS_BLOCK
+            for i in range(0, whole, COMPRESS_BLOCK):
+                yield payload[i:i + COMPRESS_BLOCK]
+            payload = payload[whole:]
+        buf += payload
+        while len(buf) >= COMPRESS_BLOCK:
+            yield bytes(buf[:COMPRESS_BLOCK])
+            del buf[:COMPRESS_BLOCK]
+    if buf:
+        yield bytes(buf)
+
+
+def _get_compress_pool():
+    global _compress_pool
+    with _compress_pool_lock:
+        if _compress_pool is None:
+            _compress_pool = ThreadPoolExecutor(COMPRESS_WORKERS, thread_name_prefix="deflate")
+        return _compress_pool
+
+
+def _stream_pieces(part, cancel=None):
+    """Текст части кусками по ~STREAM_CHUNK: (смещение куска, кусок).
+
+    Каждый кусок заканчивается на </w:p>, поэтому плейсхолдер — даже разбитый на runs —
+    целиком попадает в один кусок. Абзац длиннее STREAM_CARRY_LIMIT режется по концу
+    тега: простой {ключ} так не разрезать, не склеятся только разбитые на runs.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    carry, base = "", 0
+    while True:
+        _check_cancel(cancel)
+        chunk = part.read(STREAM_CHUNK)
+        text = carry + decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            if text:
+                yield base, text
+            return
+        cut = text.rfind("</w:p>")
+        if cut != -1:
+            cut += len("</w:p>")
+        elif len(text) > STREAM_CARRY_LIMIT:
+            cut = text.rfind(">") + 1
+        else:
+            cut = 0
+        if cut:
+            yield base, text[:cut]
+            base += cut
+        carry = text[cut:]
+
+
+def _stream_plan(part):
+    """План подстановки крупной части: ([(начало, длина, срезы, ключи)], [(ключ, смещение)]).
+
+    Начало и длина — в распакованных байтах части, только для кусков с плейсхолдерами.
+    Срезы — array пар (от, до) в байтах куска, после каждой пары — ключ из ключей
+    ("" — без подстановки); склеенные runs (_heal_plan) — это просто другой порядок срезов.
+    Смещения ключей — в символах склеенного текста, как у обычных частей.
+    """
+    plan, offsets, names, pos = [], [], {}, 0
+    for base, piece in _stream_pieces(part):
+        size = len(piece.encode("utf-8"))
+        if "{" in piece:
+            runs = _heal_plan(piece)
+            healed = piece if runs is None else "".join(piece[a:b] for a, b in runs)
+            runs = runs or [(0, len(piece))]
+            found = [(m.start(), m.end(), names.setdefault(m.group(1), m.group(1)))
+                     for m in _PLACEHOLDER_RE.finditer(healed)]
+            if found:
+                cuts, keys = _piece_cuts(piece, runs, found, len(healed))
+                plan.append((pos, size, cuts, tuple(keys)))
+                offsets.extend((k, base + start) for start, _, k in found)
+        pos += size
+    return plan, offsets
+
+
+def _piece_cuts(piece, runs, found, length):
+    # литералы склеенного текста между плейсхолдерами → срезы исходного куска (в байтах)
+    if runs == [(0, length)]:
+        # склеивать нечего: литералы — промежутки между плейсхолдерами
+        cuts = [0]
+        for start, end, _ in found:
+            cuts += (start, end)
+        cuts.append(length)
+        keys = [key for _, _, key in found]
+        keys.append("")
+    else:
+        cuts, keys = _moved_cuts(runs, found, length)
+    if not piece.isascii():
+        # символы → байты UTF-8 одним проходом по отсортированным смещениям
+        to_bytes, prev, n = {}, 0, 0
+        for c in sorted(set(cuts)):
+            n += len(piece[prev:c].encode("utf-8"))
+            to_bytes[c], prev = n, c
+        cuts = [to_bytes[c] for c in cuts]
+    return array("I", cuts), keys
+
+
+def _moved_cuts(runs, found, length):
+    # то же, когда после _heal_plan литерал может состоять из нескольких кусков исходного текста
+    cuts, keys = [], []
+    ri, run_at = 0, 0        # текущий кусок runs и его начало в склеенном тексте
+    at = 0
+    for start, end, key in found + [(length, length, "")]:
+        first = len(keys)
+        while at < start:
+            a, b = runs[ri]
+            if at >= run_at + b - a:
+                run_at += b - a
+                ri += 1
                 continue
-            with open(p, "r", encoding="utf-8") as f:
-                xml = f.read()
-            for k, v in values.items():
-                token = "{" + k + "}"
-                xml = xml.replace(token, str(v))
-            with open(p, "w", encoding="utf-8") as f:
-                f.write(xml)
-
-        # собрать обратно в docx
-        with zipfile.ZipFile(out_path, 'w', zipfile.ZIP_DEFLATED) as zout:
-            for root, _, files in os.walk(tmpdir):
-                for name in files:
-                    full = os.path.join(root, name)
-                    arc = os.path.relpath(full, tmpdir)
-                    zout.write(full, arc)
-    finally:
+            stop = min(start, run_at + b - a)
+            cuts += (a + at - run_at, a + stop - run_at)
+            keys.append("")
+            at = stop
+        if len(keys) == first:
+            cuts += (0, 0)
+            keys.append("")
+        keys[-1] = key
+        at = end
+    return cuts, keys
+
+
+def _splice_stream(part, plan, values, unresolved, cancel=None):
+    # распакованные байты части с подставленными значениями, кусками
+    subs = {k: escape(str(v)).encode("utf-8") for k, v in values.items()}
+    pos = 0
+    for start, size, cuts, keys in plan:
+        _check_cancel(cancel)
+        while pos < start:
+            chunk = part.read(min(STREAM_CHUNK, start - pos))
+            if not chunk:
+                raise zipfile.BadZipFile("Часть короче, чем при компиляции шаблона")
+            pos += len(chunk)
+            yield chunk
+        data = part.read(size)
+        out = []
+        it = iter(cuts)
+        for key in keys:
+            out.append(data[next(it):next(it)])
+            if key:
+                value = subs.get(key)
+                if value is None:
+                    unresolved.add(key)
+                    value = b"{" + key.encode("utf-8") + b"}"
+                out.append(value)
+        pos += size
+        yield b"".join(out)
+    while True:
+        _check_cancel(cancel)
+        chunk = part.read(STREAM_CHUNK)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_raw(f, info, offset):
+    # сжатые данные члена архива из файла, кусками; offset — из _member_data_offset
+    f.seek(offset)
+    left = info.compress_size
+    while left:
+        chunk = f.read(min(left, STREAM_CHUNK))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Обрезанные данные: {info.filename}")
+        left -= len(chunk)
+        yield chunk
+
+
+def _inflate(chunks):
+    # распаковка deflate кусками не больше STREAM_CHUNK
+    d = zlib.decompressobj(-15)
+    for chunk in chunks:
+        while chunk:
+            out = d.decompress(chunk, STREAM_CHUNK)
+            if out:
+                yield out
+            chunk = d.unconsumed_tail
+    out = d.flush()
+    if out:
+        yield out
+
+
+class _CountingReader:
+    # файл, который считает прочитанные байты (для profiling)
+    def __init__(self, f):
+        self._f = f
+        self.count = 0
+
+    def read(self, n=-1):
+        data = self._f.read(n)
+        self.count += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+class TemplateChanged(Exception):
+    """Файл шаблона перезаписан после компиляции; load_template соберёт его заново."""
+
+
+def _file_stat(f):
+    st = os.fstat(f.fileno())
+    return st.st_mtime_ns, st.st_size
+
+
+def _check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise RenderCancelled()
+
+
+class RenderResult:
+    """Итог рендера: куда записан файл, какие {ключи} шаблона остались без значения,
+    был ли файл взят из OutputCache, профиль сжатия и время этапов в секундах
+    ("substitute", "compress", "pack"; у файла из кэша — пусто)."""
+
+    __slots__ = ("path", "unresolved", "cached", "profile", "timings")
+
+    def __init__(self, path, unresolved, cached=False, profile=DEFAULT_PROFILE, timings=None):
+        self.path = path
+        self.unresolved = unresolved
+        self.cached = cached
+        self.profile = profile
+        self.timings = timings or {}
+
+
+@contextmanager
+def _atomic_output(out_path):
+    # пишем во временный файл рядом с целевым и атомарно подменяем; при ошибке — убираем
+    fd, tmp = tempfile.mkstemp(prefix=".docx_", suffix=".tmp",
+                               dir=os.path.dirname(os.path.abspath(out_path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        # mkstemp создаёт файл с правами 0600: берём права заменяемого файла,
+        # а для нового — обычные 0666 & ~umask
         try:
-            shutil.rmtree(tmpdir, ignore_errors=True)
-        except:
+            if os.path.exists(out_path):
+                shutil.copymode(out_path, tmp)
+            elif _UMASK is not None:
+                os.chmod(tmp, 0o666 & ~_UMASK)
+        except OSError:
             pass
+        os.replace(tmp, out_path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _member_data_offset(f, info):
+    # где начинаются сжатые данные члена архива: пропускаем локальный заголовок
+    f.seek(info.header_offset)
+    header = f.read(30)
+    if header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"Битый локальный заголовок: {info.filename}")
+    name_len, extra_len = struct.unpack("<2H", header[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+
+def _dos_datetime(date_time):
+    y, mo, d, h, mi, s = date_time
+    return (h << 11) | (mi << 5) | (s // 2), ((y - 1980) << 9) | (mo << 5) | d
+
+
+class _ZipWriter:
+    """Минимальный писатель zip: сжатые данные пишутся как есть, без повторного deflate;
+    level — уровень для write_data/write_stream."""
+
+    def __init__(self, fp, level=zlib.Z_DEFAULT_COMPRESSION):
+        self.fp = fp
+        self.level = level
+        self.central = []
+        self.offset = 0
+
+    def write_raw(self, info, raw):
+        # raw — байты или итератор кусков длиной ровно info.compress_size
+        chunks = (raw,) if isinstance(raw, bytes) else raw
+        self._write_entry(info, info.compress_type, info.CRC, chunks, info.compress_size, info.file_size)
+
+    def write_data(self, info, payload):
+        self.write_deflated(info, *_deflate(payload, self.level))
+
+    def write_deflated(self, info, raw, crc, size):
+        # уже сжатые (deflate без заголовка) данные, например из _deflate
+        self._write_entry(info, zipfile.ZIP_DEFLATED, crc, (raw,), len(raw), size)
+
+    def write_stream(self, info, payloads):
+        # размер и crc заранее неизвестны: пишем заголовок с нулями и правим его в конце
+        crc = size = csize = 0
+
+        def counted():
+            nonlocal crc, size
+            for payload in payloads:
+                crc = zlib.crc32(payload, crc)
+                size += len(payload)
+                yield payload
+
+        def compressed():
+            nonlocal csize
+            for out in _deflate_iter(counted(), self.level):
+                csize += len(out)
+                yield out
+
+        header_at = self.offset
+        self._write_entry(info, zipfile.ZIP_DEFLATED, 0, compressed(), None, 0)
+        end = self.fp.tell()
+        self.fp.seek(header_at + 14)
+        self.fp.write(struct.pack("<3L", crc, csize, size))
+        self.fp.seek(end)
+        self.central[-1] = self.central[-1][:16] + struct.pack("<3L", crc, csize, size) + self.central[-1][28:]
+
+    def _write_entry(self, info, method, crc, chunks, csize, size):
+        # csize=None — размер посчитается по мере записи (write_stream)
+        try:
+            name = info.filename.encode("ascii")
+            flag = info.flag_bits & 0x06
+        except UnicodeEncodeError:
+            name = info.filename.encode("utf-8")
+            flag = (info.flag_bits & 0x06) | 0x800
+        if method != zipfile.ZIP_DEFLATED:
+            flag &= ~0x06
+        dostime, dosdate = _dos_datetime(info.date_time)
+        header = struct.pack("<4s2B4HL2L2H", b"PK\x03\x04", 20, 0, flag, method,
+                             dostime, dosdate, crc, csize or 0, size, len(name), 0)
+        self.fp.write(header)
+        self.fp.write(name)
+        written = 0
+        for chunk in chunks:
+            self.fp.write(chunk)
+            written += len(chunk)
+        self.central.append(struct.pack(
+            "<4s4B4HL2L5H2L", b"PK\x01\x02", 20, 0, 20, 0, flag, method,
+            dostime, dosdate, crc, written, size, len(name), 0, 0, 0, 0,
+            info.external_attr & 0xFFFFFFFF, self.offset) + name)
+        self.offset += len(header) + len(name) + written
+
+    def close(self):
+        cd = b"".join(self.central)
+        self.fp.write(cd)
+        self.fp.write(struct.pack("<4s4H2LH", b"PK\x05\x06", 0, 0, len(self.central),
+                                  len(self.central), len(cd), self.offset, 0))
+
+
+def split_placeholders(xml):
+    """Один проход по XML: (сегменты, [(ключ, смещение)]).
+
+    В сегментах литералы стоят на чётных местах, ключи {…} — на нечётных.
+    Смещения — позиции "{" в XML после склейки разбитых runs.
+    """
+    xml = _heal_runs(xml)
+    segs, offsets, pos = [], [], 0
+    for m in _PLACEHOLDER_RE.finditer(xml):
+        segs.append(xml[pos:m.start()])
+        segs.append(m.group(1))
+        offsets.append((m.group(1), m.start()))
+        pos = m.end()
+    segs.append(xml[pos:])
+    return segs, offsets
+
+
+def discover_parts(zin):
+    """Все части с текстом документа: по [Content_Types].xml и связям основного документа.
+
+    Кроме document/header/footer это сноски, концевые сноски и примечания.
+    Стандартные части из XML_PARTS берутся всегда, даже если архив их не объявил
+    (шаблоны, собранные не Word'ом, часто без overrides и связей).
+    """
+    names = set(zin.namelist())
+    found = set()
+    try:
+        types = zin.read("[Content_Types].xml").decode("utf-8")
+    except KeyError:
+        types = ""
+    for m in _OVERRIDE_RE.finditer(types):
+        attrs = dict(_ATTR_RE.findall(m.group(0)))
+        if _TEXT_CONTENT_TYPE_RE.search(attrs.get("ContentType", "")):
+            found.add(attrs.get("PartName", "").lstrip("/"))
+
+    main_parts = _rel_targets(zin, "_rels/.rels", "", ("/officeDocument",)) or ["word/document.xml"]
+    found.update(main_parts)
+    for main in main_parts:
+        folder, name = posixpath.split(main)
+        found.update(_rel_targets(zin, posixpath.join(folder, "_rels", name + ".rels"), folder, _TEXT_REL_TYPES))
+
+    found.update(XML_PARTS)
+    return frozenset(found & names)
+
+
+def _rel_targets(zin, rels_name, folder, type_suffixes):
+    try:
+        rels = zin.read(rels_name).decode("utf-8")
+    except KeyError:
+        return []
+    out = []
+    for m in _RELATIONSHIP_RE.finditer(rels):
+        attrs = dict(_ATTR_RE.findall(m.group(0)))
+        if attrs.get("TargetMode") == "External" or not attrs.get("Type", "").endswith(type_suffixes):
+            continue
+        target = attrs.get("Target", "")
+        if target.startswith("/"):
+            out.append(target.lstrip("/"))
+        else:
+            out.append(posixpath.normpath(posixpath.join(folder, target)))
+    return out
+
+
+def _heal_runs(xml):
+    plan = _heal_plan(xml)
+    return xml if plan is None else "".join(xml[a:b] for a, b in plan)
+
+
+def _heal_plan(xml):
+    # "{" в одном <w:t>, "}" в одном из следующих того же абзаца → переносим весь
+    # плейсхолдер в первый фрагмент, остальные фрагменты укорачиваем.
+    # None — склеивать нечего; иначе [(начало, конец)] кусков xml, из которых
+    # по порядку складывается склеенный текст
+    if "{" not in xml:
+        return None
+    parts = _TAG_SPLIT_RE.split(xml)   # чётные — текст, нечётные — теги
+    pending = None                     # (индекс текста с "{", позиция "{", [индексы середины])
+    moved = {}                         # индекс фрагмента → его куски xml после переноса
+    starts = None
+    for i in range(2, len(parts), 2):
+        tag = parts[i - 1]
+        if tag.startswith("</w:p>"):
+            pending = None
+        if not _RUN_TEXT_RE.match(tag):
+            continue
+        text = parts[i]
+        if pending is not None:
+            start, pos, middle = pending
+            close = text.find("}")
+            opened = text.find("{")
+            if close == -1 and opened == -1:
+                middle.append(i)
+                if len(parts[start]) - pos + sum(len(parts[j]) for j in middle) > MAX_KEY_LEN:
+                    pending = None
+                continue
+            pending = None
+            if close != -1 and (opened == -1 or close < opened):
+                glued = "".join(parts[j] for j in middle) + text[:close + 1]
+                if _PLACEHOLDER_RE.fullmatch(parts[start][pos:] + glued):
+                    if starts is None:
+                        starts = [0, *accumulate(map(len, parts))]
+                    spans = moved.get(start, [(starts[start], starts[start + 1])])
+                    for j in middle:
+                        spans += moved.get(j, [(starts[j], starts[j + 1])])
+                        moved[j] = []
+                    moved[start] = spans + [(starts[i], starts[i] + close + 1)]
+                    moved[i] = [(starts[i] + close + 1, starts[i + 1])]
+                    parts[start] += glued
+                    for j in middle:
+                        parts[j] = ""
+                    parts[i] = text = text[close + 1:]
+        opened = text.rfind("{")
+        if opened != -1 and text.find("}", opened) == -1:
+            pending = (i, opened, [])
+    if not moved:
+        return None
+    # между перенесёнными фрагментами xml идёт подряд — один кусок
+    plan, at = [], 0
+    for j in sorted(moved):
+        for a, b in [(at, starts[j])] + moved[j]:
+            if a == b:
+                continue
+            if plan and plan[-1][1] == a:
+                plan[-1] = (plan[-1][0], b)
+            else:
+                plan.append((a, b))
+        at = starts[j + 1]
+    if at < len(xml):
+        if plan and plan[-1][1] == at:
+            plan[-1] = (plan[-1][0], len(xml))
+        else:
+            plan.append((at, len(xml)))
+    return plan
+
+
+def _join_segments(segs, values, unresolved=None):
+    # значения экранируются: "&", "<", ">" в тексте ломают XML части
+    out = list(segs)
+    for i in range(1, len(out), 2):
+        k = out[i]
+        if k in values:
+            out[i] = escape(str(values[k]))
+        else:
+            out[i] = "{" + k + "}"
+            if unresolved is not None:
+                unresolved.add(k)
+    return "".join(out)
+
+
+def load_template(template_path: str) -> CompiledTemplate:
+    path = os.path.abspath(template_path)
+    st = os.stat(path)
+    with _cache_lock:
+        known = _digests.get(path)
+        if known and known[:2] == (st.st_mtime_ns, st.st_size):
+            key = (path, st.st_mtime_ns, known[2])
+            tpl = _cache.get(key)
+            if tpl is not None:
+                _cache.move_to_end(key)
+                return tpl
+
+    with profiling.stage("template_load") as ps:
+        sha = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(STREAM_CHUNK), b""):
+                sha.update(chunk)
+                ps.add(read=len(chunk))
+        digest = sha.hexdigest()
+        key = (path, st.st_mtime_ns, digest)
+        tpl = CompiledTemplate(path, digest, ps)
+
+    with _cache_lock:
+        # старые версии того же файла больше не понадобятся
+        for stale in [k for k in _cache if k[0] == path and k != key]:
+            del _cache[stale]
+        _digests[path] = (st.st_mtime_ns, st.st_size, digest)
+        _cache[key] = tpl
+        _cache.move_to_end(key)
+        while len(_cache) > TEMPLATE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return tpl
+
+
+def clear_template_cache():
+    with _cache_lock:
+        _cache.clear()
+        _digests.clear()
+
+
+class OutputCache:
+    """Готовые .docx на диске, ключ — sha1 шаблона + значения плейсхолдеров.
+
+    Изменённый шаблон даёт новый sha1, так что старые файлы больше не совпадают;
+    при первой записи с новым sha1 они удаляются. Размер ограничен max_bytes,
+    вытесняются давно не использованные (mtime обновляется при попадании).
+    """
+
+    def __init__(self, directory, max_bytes=OUTPUT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._digests = {}   # путь шаблона → sha1, с которым в кэш писали последний раз
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, tpl, values, profile=DEFAULT_PROFILE):
+        blob = json.dumps({k: str(v) for k, v in values.items()}, ensure_ascii=False, sort_keys=True)
+        return tpl.digest + "-" + hashlib.sha1((profile + "\0" + blob).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".docx")
+
+    def fetch(self, key, out_path):
+        src = self._path(key)
+        try:
+            with open(src, "rb") as fin, profiling.stage("cache_fetch") as ps, _atomic_output(out_path) as fout:
+                shutil.copyfileobj(fin, fout, 1024 * 1024)
+                ps.add(read=fin.tell(), written=fout.tell())
+            os.utime(src)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, tpl, key, rendered_path):
+        with self._lock:
+            old = self._digests.get(tpl.path)
+            self._digests[tpl.path] = tpl.digest
+        if old and old != tpl.digest:
+            self._drop_prefix(old + "-")
+        try:
+            with open(rendered_path, "rb") as fin, _atomic_output(self._path(key)) as fout:
+                shutil.copyfileobj(fin, fout, 1024 * 1024)
+        except OSError:
+            return
+        self._evict()
+
+    def _entries(self):
+        out = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".docx"):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                out.append((st.st_mtime, st.st_size, name))
+        return out
+
+    def _drop_prefix(self, prefix):
+        for _, _, name in self._entries():
+            if name.startswith(prefix):
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+
+def replace_in_docx(template_path: str, out_path: str, values: dict,
+                    progress=None, cancel=None, cache=None, profile=DEFAULT_PROFILE) -> RenderResult:
+    # этап "copy" — чтение шаблона (из кэша, если он не менялся)
+    _profile(profile)
+    if progress:
+        progress("copy", 0, 1)
+    tpl = load_template(template_path)
+    key = cache.key(tpl, values, profile) if cache is not None else None
+    if key is not None and cache.fetch(key, out_path):
+        if progress:
+            progress("copy", 1, 1)
+        return RenderResult(out_path, sorted(tpl.keys() - values.keys()), cached=True, profile=profile)
+    if progress:
+        progress("copy", 1, 1)
+    _check_cancel(cancel)
+    try:
+        result = tpl.render(out_path, values, progress, cancel, profile)
+    except TemplateChanged:
+        # шаблон заменили между load_template и рендером — один раз компилируем заново
+        tpl = load_template(template_path)
+        key = cache.key(tpl, values, profile) if cache is not None else None
+        result = tpl.render(out_path, values, progress, cancel, profile)
+    if key is not None:
+        cache.store(tpl, key, out_path)
+    return result
+
+
+def set_output_names(short_name, template_paths):
+    """Имена файлов набора: первый шаблон — short_name, остальные — short_name
+    с именем шаблона ("5 3А 20 2700 - АКТ.DOCX"). Совпавшие имена (одинаковые имена
+    шаблонов из разных папок, один шаблон дважды) получают " (2)", " (3)"…"""
+    stem, ext = os.path.splitext(short_name)
+    names, taken = [], set()
+    for i, path in enumerate(template_paths):
+        name = short_name
+        if i:
+            label = os.path.splitext(os.path.basename(path))[0]
+            name = f"{stem} - {label.upper() if short_name.isupper() else label}{ext}"
+        base, n = os.path.splitext(name)[0], 1
+        # без учёта регистра: на карте памяти Android «Акт» и «АКТ» — один файл
+        while name.casefold() in taken:
+            n += 1
+            name = f"{base} ({n}){ext}"
+        taken.add(name.casefold())
+        names.append(name)
+    return names
+
+
+def _get_render_pool():
+    global _render_pool
+    with _compress_pool_lock:
+        if _render_pool is None:
+            _render_pool = ThreadPoolExecutor(RENDER_SET_WORKERS, thread_name_prefix="render")
+        return _render_pool
+
+
+def render_set(jobs, values, progress=None, cancel=None, cache=None, profile=DEFAULT_PROFILE):
+    """Рендер одних значений в несколько шаблонов параллельно.
+
+    jobs — [(путь шаблона, путь результата)]; каждый шаблон читается один раз
+    (load_template). progress("pack", готово шаблонов, всего). Возвращает RenderResult
+    в порядке jobs; если какой-то шаблон не собрался — ошибка первого из них.
+    """
+    if progress:
+        progress("pack", 0, len(jobs))
+    pool = _get_render_pool()
+    futures = [pool.submit(replace_in_docx, tpl, out, values, cancel=cancel, cache=cache, profile=profile)
+               for tpl, out in jobs]
+    done = 0
+    results, error = [], None
+    for fut in futures:
+        try:
+            results.append(fut.result())
+        except Exception as e:
+            error = error or e
+            results.append(None)
+        done += 1
+        if progress:
+            progress("pack", done, len(jobs))
+    if error is not None:
+        raise error
+    return results
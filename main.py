@@ -1,90 +1,223 @@
 # main.py — Kivy-приложение (Android/ПК). Генерация .docx через docx_simple.
+# Редко нужное (plyer, android.permissions, docx_simple) импортируется при первом
+# использовании; вехи холодного старта пишутся в лог Kivy ("Startup: …").
+
+import time
+_T0 = time.perf_counter()   # отсчёт холодного старта — до импорта kivy
 
 from kivy.app import App
 from kivy.lang import Builder
 from kivy.uix.boxlayout import BoxLayout
-from kivy.properties import StringProperty, BooleanProperty, DictProperty
+from kivy.properties import StringProperty, BooleanProperty, DictProperty, NumericProperty, ListProperty
 from kivy.clock import Clock
+from kivy.factory import Factory
 from kivy.utils import platform
+from kivy.logger import Logger
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import RotatingFileHandler
+import logging
 from datetime import datetime
 import os
+import threading
 
+import profiling
 from contract_logic import (
     INSTITUTIONS,
     BRIEF_LABELS,
-    strict_parse_brief,
-    detect_category,
-    match_complect,
-    get_hours,
-    round_down_to_thousand,
+    CONTRACT_KEYS,
+    IncrementalBriefParser,
+    Quote,
+    iter_briefs,
 )
-from docx_simple import replace_in_docx
-
-try:
-    from plyer import filechooser, sharing
-except ImportError:
-    filechooser = None
-    sharing = None
-
-try:
-    if platform == 'android':
-        from android.permissions import request_permissions, Permission
-    else:
-        request_permissions = None
-        Permission = None
-except ImportError:
-    request_permissions = None
-    Permission = None
+
+
+def startup_mark(stage):
+    Logger.info(f"Startup: {stage}: {(time.perf_counter() - _T0) * 1000:.0f} ms")
+
+
+_plyer_cache = {}
+
+def plyer_facade(name):
+    # plyer.filechooser / plyer.sharing или None, если plyer недоступен
+    if name not in _plyer_cache:
+        try:
+            import plyer
+            _plyer_cache[name] = getattr(plyer, name)
+        except (ImportError, AttributeError):
+            _plyer_cache[name] = None
+    return _plyer_cache[name]
+
 
 CONFIG_TEMPLATE_PATH_FILE = "last_template.txt"
 CONFIG_SAVE_DIR_FILE = "last_save_dir.txt"
 
+# лог на экране — кольцевой буфер из последних строк;
+# CONTRACT_LOG_FILE=путь — дублировать лог в файл с ротацией
+LOG_MAX_LINES = int(os.environ.get("CONTRACT_LOG_LINES", "500"))
+LOG_SCREEN_LINES = 100
+LOG_FILE = os.environ.get("CONTRACT_LOG_FILE", "")
+LOG_FILE_BYTES = 256 * 1024
+LOG_FILE_BACKUPS = 3
+
+# сжатие готового .docx: fast — быстрее отправить, small — меньше файл (лимиты мессенджеров)
+DOCX_PROFILE = os.environ.get("CONTRACT_DOCX_PROFILE", "balanced")
+
+# строки превью сверху вниз; у каждой свой Label
+PREVIEW_FIELDS = (
+    "institution", "klass", "category", "complect", "kids", "albums", "price",
+    "pages", "hours", "fio", "phone", "vk", "total", "prepay", "rest", "date", "file_name",
+)
+
+# разбор пачки брифов (кнопка "Разбить") — не дольше стольких секунд за кадр
+SPLIT_FRAME_BUDGET = 0.008
+
+# сколько найденных записей реестра показывать в логе
+REGISTRY_SHOWN = 20
+
+# этап генерации → (подпись, диапазон прогресса в %)
+GENERATION_STAGES = {
+    "copy": ("Чтение шаблона…", (0, 10)),
+    "substitute": ("Подстановка данных…", (10, 40)),
+    "pack": ("Упаковка .docx…", (40, 90)),
+    "share": ("Отправка…", (90, 100)),
+}
+
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+def share_files_android(paths):
+    """Все файлы одним ACTION_SEND_MULTIPLE (Android, pyjnius). False — не вышло,
+    тогда вызывающий отправляет файлы по одному через plyer."""
+    if platform != "android":
+        return False
+    try:
+        from jnius import autoclass
+        activity = autoclass("org.kivy.android.PythonActivity").mActivity
+        Intent = autoclass("android.content.Intent")
+        FileProvider = autoclass("androidx.core.content.FileProvider")
+        File = autoclass("java.io.File")
+        ArrayList = autoclass("java.util.ArrayList")
+        authority = activity.getPackageName() + ".fileprovider"
+        uris = ArrayList()
+        for path in paths:
+            uris.add(FileProvider.getUriForFile(activity, authority, File(path)))
+        intent = Intent(Intent.ACTION_SEND_MULTIPLE)
+        intent.setType(DOCX_MIME)
+        intent.putParcelableArrayListExtra(Intent.EXTRA_STREAM, uris)
+        intent.addFlags(Intent.FLAG_GRANT_READ_URI_PERMISSION)
+        activity.startActivity(Intent.createChooser(intent, None))
+        return True
+    except Exception:
+        return False
+
 
 class Root(BoxLayout):
-    preview_html = StringProperty("")
     log_text = StringProperty("")
     date_text = StringProperty(datetime.now().strftime("%d %B %Y г."))
     template_status = StringProperty("❌ Шаблон не выбран")
     citata_on = BooleanProperty(False)
     brief_data = DictProperty({})
     template_path = StringProperty("")
+    template_set = ListProperty([])   # набор шаблонов (договор, счёт, акт…); первый — template_path
     last_save_dir = StringProperty("")
+    busy = BooleanProperty(False)
+    progress_value = NumericProperty(0)
+    progress_text = StringProperty("")
+
+    def __init__(self, **kwargs):
+        self._parser = IncrementalBriefParser()
+        # рендер .docx идёт вне UI-потока, по одному договору за раз
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._cancel_event = None
+        self._output_cache = None
+        self._profile_records = []
+        self._registry = None
+        self._dialog_open = False
+        self._split_iter = None
+        self._split_event = None
+        self.split_records = []
+        self._quote = None
+        self._preview_rows = {}
+        self._log_file = self._open_log_file()
+        self._log_lines = deque(maxlen=LOG_SCREEN_LINES if self._log_file else LOG_MAX_LINES)
+        self._log_flush_trigger = Clock.create_trigger(self._flush_log, 0)
+        # правки брифа за один кадр схлопываются в один разбор
+        self._parse_trigger = Clock.create_trigger(self.parse_brief, 0)
+        super().__init__(**kwargs)
 
     def on_kv_post(self, base_widget):
+        self._build_preview()
         Clock.schedule_once(self._post_init, 0)
 
     def _post_init(self, *_):
-        if platform == 'android' and request_permissions and Permission:
+        if platform == 'android':
             try:
+                from android.permissions import request_permissions, Permission
                 request_permissions([Permission.READ_EXTERNAL_STORAGE, Permission.WRITE_EXTERNAL_STORAGE])
             except Exception:
                 pass
         self.load_last_template()
         self.load_last_save_dir()
-        self.template_status = (
-            f"✅ Шаблон: {os.path.basename(self.template_path)}"
-            if self.template_path and os.path.exists(self.template_path)
-            else "❌ Шаблон не выбран"
-        )
-        self.parse_brief()
+        # load_last_template уже проверил, что файл существует
+        self.template_status = self._template_status()
+        if self.ids.brief.text.strip():
+            self.parse_brief()
+        startup_mark("post_init")
 
     def log(self, msg):
-        self.log_text += msg + "\n"
+        self._log_lines.append(msg)
+        if self._log_file is not None:
+            self._log_file.info(msg)
+        self._log_flush_trigger()
+
+    def clear_log(self):
+        self._log_lines.clear()
+        self.log_text = ""
+
+    def _flush_log(self, *_):
+        # один пересчёт TextInput лога за кадр, сколько бы строк ни пришло
+        self.log_text = "".join(line + "\n" for line in self._log_lines)
+
+    def _open_log_file(self):
+        # зеркало лога в файл с ротацией: в памяти тогда держим только хвост для экрана
+        if not LOG_FILE:
+            return None
+        try:
+            handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_FILE_BYTES, backupCount=LOG_FILE_BACKUPS,
+                                          encoding="utf-8")
+        except OSError:
+            return None
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger = logging.getLogger("contract.ui")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        return logger
 
     def set_citata(self, value):
         self.citata_on = value
         self.update_preview()
 
     def load_last_template(self):
+        # по пути на строку: первый — основной шаблон, дальше — остальные шаблоны набора
         try:
             if os.path.exists(CONFIG_TEMPLATE_PATH_FILE):
                 with open(CONFIG_TEMPLATE_PATH_FILE, 'r', encoding='utf-8') as f:
-                    p = f.read().strip()
-                    if p and os.path.exists(p):
-                        self.template_path = p
+                    paths = [p.strip() for p in f if p.strip() and os.path.exists(p.strip())]
+                if paths:
+                    self.template_set = paths
+                    self.template_path = paths[0]
         except Exception:
             pass
 
+    def _template_status(self):
+        if not self.template_path:
+            return "❌ Шаблон не выбран"
+        extra = len(self.template_set) - 1
+        return f"✅ Шаблон: {os.path.basename(self.template_path)}" + (f" (+{extra})" if extra > 0 else "")
+
     def load_last_save_dir(self):
         try:
             if os.path.exists(CONFIG_SAVE_DIR_FILE):
@@ -96,24 +229,51 @@ class Root(BoxLayout):
             pass
 
     def choose_template(self):
+        filechooser = plyer_facade("filechooser")
         if not filechooser:
             self.log("❗ filechooser недоступен — запустите на Android/desktop с plyer")
             return
         try:
-            filechooser.open_file(filters=[("DOCX", "*.docx")], on_selection=self._on_template_chosen)
+            filechooser.open_file(filters=[("DOCX", "*.docx")], multiple=True,
+                                  on_selection=self._on_template_chosen)
         except Exception as e:
             self.log(f"❗ Ошибка выбора файла: {e}")
 
     def _on_template_chosen(self, selection):
         if selection:
+            self.template_set = list(selection)
             self.template_path = selection[0]
             try:
                 with open(CONFIG_TEMPLATE_PATH_FILE, 'w', encoding='utf-8') as f:
-                    f.write(self.template_path)
+                    f.write("\n".join(self.template_set))
             except Exception:
                 pass
-            self.template_status = f"✅ Шаблон: {os.path.basename(self.template_path)}"
-            self.log(f"Шаблон выбран: {self.template_path}")
+            self.template_status = self._template_status()
+            for path in self.template_set:
+                self.log(f"Шаблон выбран: {path}")
+                # разбор и индекс плейсхолдеров — в фоне; заодно шаблон попадает в кэш
+                self._executor.submit(self._index_template_job, path)
+
+    def _index_template_job(self, path):
+        from docx_simple import load_template
+        try:
+            tpl = load_template(path)
+        except Exception as e:
+            msg = f"❗ Не удалось прочитать шаблон: {e}"
+            Clock.schedule_once(lambda dt: self.log(msg), 0)
+            return
+        Clock.schedule_once(lambda dt: self._report_template_index(tpl), 0)
+
+    def _report_template_index(self, tpl):
+        used = tpl.keys()
+        parts = sorted({part for refs in tpl.index.values() for part, _ in refs})
+        self.log(f"Плейсхолдеров в шаблоне: {len(used)} ({', '.join(parts) or 'нет'})")
+        unknown = sorted(used - set(CONTRACT_KEYS))
+        unused = [k for k in CONTRACT_KEYS if k not in used]
+        if unknown:
+            self.log("⚠ Неизвестные ключи, останутся как есть: " + ", ".join("{" + k + "}" for k in unknown))
+        if unused:
+            self.log("⚠ Не используются шаблоном: " + ", ".join("{" + k + "}" for k in unused))
 
     def reset_form(self):
         self.ids.fio.text = ""
@@ -126,23 +286,67 @@ class Root(BoxLayout):
         self.citata_on = False
         self.date_text = datetime.now().strftime("%d %B %Y г.")
         self.brief_data = {}
-        self.preview_html = ""
-        self.log_text = ""
+        self._show_preview({})
+        self.clear_log()
+
+    def request_parse(self, *_):
+        self._parse_trigger()
 
     def parse_brief(self, *_):
-        self.log_text = ""
+        self.clear_log()
         btxt = self.ids.brief.text
         user_type = self.ids.institution.text if self.ids.institution.text != "Авто" else None
-        data = strict_parse_brief(btxt, user_type)
-        category = detect_category(data.get('тип_учреждения', ''), data.get('класс', ''), data.get('номер_группы', ''))
-        data['категория'] = category
-        complect, pages = match_complect(data.get('стоимость_одного_альбома',''), category)
-        data['комплект'] = complect or ''
-        data['страницы_комплекта'] = pages or ''
-        data['часы'] = get_hours(data.get('кол_альбомов',''), complect) if complect else ''
+        data = self._parser.parse(btxt, user_type)
         self.brief_data = data
         self.update_preview()
 
+    def split_briefs(self):
+        # несколько брифов подряд в поле ввода: разбираем по кадрам, результаты — в лог сразу
+        self._stop_split()
+        self.clear_log()
+        user_type = self.ids.institution.text if self.ids.institution.text != "Авто" else None
+        self.split_records = []
+        self._split_iter = iter_briefs(self.ids.brief.text, user_type)
+        self._split_event = Clock.schedule_interval(self._consume_briefs, 0)
+
+    def _consume_briefs(self, dt):
+        t0 = time.perf_counter()
+        for rec in self._split_iter:
+            self.split_records.append(rec)
+            if rec.error:
+                self.log(f"❗ {rec.index} (строка {rec.line}): {rec.error}")
+            else:
+                d = rec.data
+                self.log(f"📄 {rec.index} (строка {rec.line}): {d.get('тип_учреждения','')} "
+                         f"№{d.get('номер_учреждения','')}, {d.get('класс','')} — "
+                         f"{d.get('кол_альбомов','')} × {d.get('стоимость_одного_альбома','')}")
+            if time.perf_counter() - t0 > SPLIT_FRAME_BUDGET:
+                return True
+        bad = sum(1 for r in self.split_records if r.error)
+        self.log(f"Брифов: {len(self.split_records)}, с ошибками: {bad}")
+        self._stop_split()
+        return False
+
+    def _stop_split(self):
+        if self._split_event is not None:
+            self._split_event.cancel()
+        self._split_event = self._split_iter = None
+
+    def current_quote(self):
+        # один расчёт на превью и генерацию; пересчитываются только поля с изменившимися входами
+        inputs = dict(
+            data=self.brief_data or {},
+            citata_on=self.citata_on,
+            fio=self.ids.fio.text,
+            vk=self.ids.vk.text,
+            prepay=self.ids.prepay.text,
+            pages=self.ids.pages.text,
+            hours=self.ids.hours.text,
+            date_text=self.date_text,
+        )
+        self._quote = Quote(**inputs) if self._quote is None else self._quote.evolve(**inputs)
+        return self._quote
+
     def update_preview(self):
         d = self.brief_data or {}
         cat = d.get('категория','')
@@ -155,154 +359,273 @@ class Root(BoxLayout):
         else:
             inst_line = "Учреждение: [color=#ff4444][b]не определено![/b][/color]"
 
-        try:
-            base_price = int(d.get('стоимость_одного_альбома','') or 0)
-        except:
-            base_price = 0
-        price = base_price + (200 if (self.citata_on and base_price) else 0)
-
-        try:
-            alb = int(d.get('кол_альбомов', 0) or 0)
-        except:
-            alb = 0
-        total = price * alb
-        prepay_in = self.ids.prepay.text
-        if not prepay_in:
-            prepay_val = round_down_to_thousand(total * 0.3)
-        else:
-            try:
-                prepay_val = int(prepay_in)
-            except:
-                prepay_val = round_down_to_thousand(total * 0.3)
-        rest = total - prepay_val
-
-        pages = self.ids.pages.text or (d.get('страницы_комплекта') or "")
-        hours = self.ids.hours.text or (d.get('часы') or "")
-        fio = self.ids.fio.text or d.get('фамилия','')
-        vk = self.ids.vk.text
-
-        if cat == "ДС":
-            klass_for_file = d.get('номер_группы','')
-        else:
-            klass_for_file = d.get('класс_for_file','')
-        fname = f"{d.get('номер_учреждения','')} {klass_for_file} {d.get('кол_альбомов','')} {base_price}.docx" \
-            .replace('  ', ' ').replace('""','').replace(' .','.').replace('..','.')
-        fname = fname.upper()
-
-        lines = [
-            inst_line,
-            f"Класс/Группа: [b]{d.get('класс','')}[/b]",
-            f"Категория: [b]{cat}[/b]" if cat else "",
-            f"Комплект: [b]{compl}[/b]" if compl else "",
-            f"Кол-во детей: [b]{d.get('кол_детей','')}[/b]",
-            f"Кол-во альбомов: [b]{d.get('кол_альбомов','')}[/b]",
-            f"Стоимость одного альбома: [b]{price}[/b]" + (" (с цитатами)" if self.citata_on else ""),
-            f"Количество страниц: [b]{pages}[/b]",
-            f"Количество часов: [b]{hours}[/b]",
-            f"ФИО: [b]{fio}[/b]",
-            f"Телефон: [b]{d.get('телефон','')}[/b]",
-            (f"VK: [b]{vk}[/b]" if vk else ""),
-            f"Общая сумма: [b]{total}[/b]",
-            f"Предоплата: [b]{prepay_val}[/b]",
-            f"Остаток: [b]{rest}[/b]",
-            f"Дата: [b]{self.date_text}[/b]",
-            f"Название файла: [color=#2c73d2][b]{fname}[/b][/color]",
-        ]
-        self.preview_html = "\n".join([s for s in lines if s])
+        q = self.current_quote()
+
+        self._show_preview({
+            "institution": inst_line,
+            "klass": f"Класс/Группа: [b]{d.get('класс','')}[/b]",
+            "category": f"Категория: [b]{cat}[/b]" if cat else "",
+            "complect": f"Комплект: [b]{compl}[/b]" if compl else "",
+            "kids": f"Кол-во детей: [b]{d.get('кол_детей','')}[/b]",
+            "albums": f"Кол-во альбомов: [b]{d.get('кол_альбомов','')}[/b]",
+            "price": f"Стоимость одного альбома: [b]{q.price}[/b]" + (" (с цитатами)" if q.citata_on else ""),
+            "pages": f"Количество страниц: [b]{q.pages_value}[/b]",
+            "hours": f"Количество часов: [b]{q.hours_value}[/b]",
+            "fio": f"ФИО: [b]{q.fio_value}[/b]",
+            "phone": f"Телефон: [b]{d.get('телефон','')}[/b]",
+            "vk": f"VK: [b]{q.vk}[/b]" if q.vk else "",
+            "total": f"Общая сумма: [b]{q.total}[/b]",
+            "prepay": f"Предоплата: [b]{q.prepay_value}[/b]",
+            "rest": f"Остаток: [b]{q.rest}[/b]",
+            "date": f"Дата: [b]{self.date_text}[/b]",
+            "file_name": f"Название файла: [color=#2c73d2][b]{q.file_name}[/b][/color]",
+        })
+
+    def _build_preview(self):
+        box = self.ids.preview
+        for name in PREVIEW_FIELDS:
+            row = Factory.PreviewRow()
+            box.add_widget(row)
+            self._preview_rows[name] = row
+
+    def _show_preview(self, fields):
+        # текстура строки перерисовывается, только если изменился её текст;
+        # пустые строки схлопываются (см. <PreviewRow> в main.kv)
+        for name, row in self._preview_rows.items():
+            text = fields.get(name, "")
+            if row.text != text:
+                row.text = text
 
     def generate(self):
         if not self.template_path or not os.path.exists(self.template_path):
             self.log("❗ Шаблон не выбран")
             return
-
-        d = self.brief_data or {}
-        try:
-            base_price = int(d.get('стоимость_одного_альбома','') or 0)
-        except:
-            base_price = 0
-        price = base_price + (200 if (self.citata_on and base_price) else 0)
-        try:
-            alb = int(d.get('кол_альбомов', 0) or 0)
-        except:
-            alb = 0
-        total = price * alb
-        prepay_in = self.ids.prepay.text
-        if not prepay_in:
-            prepay_val = round_down_to_thousand(total * 0.3)
-        else:
-            try:
-                prepay_val = int(prepay_in)
-            except:
-                prepay_val = round_down_to_thousand(total * 0.3)
-        rest = total - prepay_val
-
-        fio = self.ids.fio.text or d.get('фамилия','')
-        vk = self.ids.vk.text
-        pages = self.ids.pages.text or (d.get('страницы_комплекта') or "")
-        hours = self.ids.hours.text or (d.get('часы') or "")
-
-        values = {
-            "учреждение": f"{d.get('тип_учреждения','')} №{d.get('номер_учреждения','')}".strip(),
-            "класс": d.get("класс", ""),
-            "кол_детей": d.get("кол_детей", ""),
-            "кол_альбомов": d.get("кол_альбомов", ""),
-            "стоимость_одного_альбома": base_price,
-            "общая_сумма": total,
-            "предоплата": prepay_val,
-            "остаток": rest,
-            "фамилия": fio,
-            "телефон": d.get("телефон", ""),
-            "ссылка_ВК": vk,
-            "кол_страниц": pages,
-            "колвочасов": hours,
-            "дата": self.date_text,
-            "номер_договора": d.get("номер_договора", ""),
-            "когдасъёмка": d.get("когдасъёмка", ""),
-            "ц": ", Цитаты" if self.citata_on else ""
-        }
-
-        cat = d.get('категория','')
-        klass_for_file = d.get('номер_группы','') if cat == "ДС" else d.get('класс_for_file','')
-        short_name = f"{d.get('номер_учреждения','')} {klass_for_file} {d.get('кол_альбомов','')} {base_price}.docx" \
-            .replace('  ', ' ').replace('""','').replace(' .','.').replace('..','.')
-        short_name = short_name.upper()
+        templates = [p for p in self.template_set if os.path.exists(p)] or [self.template_path]
+        self._generate(self.current_quote(), templates)
+
+    def _generate(self, q, templates):
+        # пока открыт диалог сохранения, повторные нажатия отбрасываются (_dialog_open);
+        # busy ставится только когда путь получен: на Android отменённый диалог
+        # не вызывает on_selection, и busy остался бы навсегда
+        if self.busy or self._dialog_open:
+            return
+        short_name = q.file_name
 
         def _save_to(selection):
-            if not selection:
-                return
-            path = selection[0]
-            try:
-                replace_in_docx(self.template_path, path, values)
-                try:
-                    with open(CONFIG_SAVE_DIR_FILE, 'w', encoding='utf-8') as f:
-                        f.write(os.path.dirname(path))
-                except Exception:
-                    pass
-                self.log(f"✅ Договор сохранён: {path}")
-                try:
-                    if sharing:
-                        sharing.share(file_path=path)
-                except Exception:
-                    pass
-            except Exception as e:
-                self.log(f"❗ Ошибка: {e}")
+            Clock.schedule_once(lambda dt: self._start_render(templates, selection, q, True), 0)
 
+        filechooser = plyer_facade("filechooser")
         if filechooser:
+            self._dialog_open = True
             try:
                 filechooser.save_file(on_selection=_save_to, filename=short_name)
             except Exception as e:
+                self._dialog_open = False
                 self.log(f"❗ Ошибка сохранения: {e}")
         else:
-            path = os.path.abspath(short_name)
+            self._start_render(templates, [os.path.abspath(short_name)], q, False)
+
+    def _start_render(self, templates, selection, q, remember_dir):
+        self._dialog_open = False
+        if not selection or self.busy:
+            return
+        self.busy = True
+        path = selection[0]
+        self._cancel_event = threading.Event()
+        self._set_progress("copy", 0, 1)
+        self._executor.submit(self._render_job, templates, path, q,
+                              self._cancel_event, remember_dir, self._get_output_cache(), self._get_registry())
+
+    def _get_output_cache(self):
+        # готовые договоры в user_data_dir: повторная генерация того же — копия файла
+        if self._output_cache is None:
+            from docx_simple import OutputCache
             try:
-                replace_in_docx(self.template_path, path, values)
-                self.log(f"✅ Договор сохранён: {path}")
+                self._output_cache = OutputCache(os.path.join(App.get_running_app().user_data_dir, "docx_cache"))
+            except Exception:
+                return None
+        return self._output_cache
+
+    def _get_registry(self):
+        # реестр выданных договоров в user_data_dir
+        if self._registry is None:
+            from registry import Registry
+            try:
+                self._registry = Registry(os.path.join(App.get_running_app().user_data_dir, "contracts.sqlite3"))
             except Exception as e:
-                self.log(f"❗ Ошибка: {e}")
+                self.log(f"❗ Реестр недоступен: {e}")
+                return None
+        return self._registry
+
+    def _render_job(self, templates, path, q, cancel, remember_dir, cache, registry):
+        # фоновый поток: UI не трогаем, всё возвращаем через Clock.
+        # path — файл основного шаблона; остальные шаблоны набора ложатся рядом (set_output_names)
+        def progress(stage, done, total):
+            Clock.schedule_once(lambda dt: self._set_progress(stage, done, total), 0)
+        from docx_simple import replace_in_docx, render_set, set_output_names
+        folder = os.path.dirname(path)
+        names = set_output_names(os.path.basename(path), templates)
+        paths = [path] + [os.path.join(folder, n) for n in names[1:]]
+        results = error = None
+        try:
+            with profiling.stage("generate"):
+                if len(templates) == 1:
+                    results = [replace_in_docx(templates[0], path, q.values(), progress=progress, cancel=cancel,
+                                               cache=cache, profile=DOCX_PROFILE)]
+                else:
+                    results = render_set(list(zip(templates, paths)), q.values(), progress=progress,
+                                         cancel=cancel, cache=cache, profile=DOCX_PROFILE)
+        except Exception as e:
+            error = e
+        if results is not None and registry is not None:
+            # в реестр — каждый файл набора (договор, счёт, акт): повторно выдаётся любой из них
+            try:
+                for template, out in zip(templates, paths):
+                    registry.add(q, template, out)
+            except Exception as e:
+                msg = f"❗ Не записано в реестр: {e}"
+                Clock.schedule_once(lambda dt: self.log(msg), 0)
+        Clock.schedule_once(lambda dt: self._render_done(paths, results, error, remember_dir), 0)
+
+    def _render_done(self, paths, results, error, remember_dir):
+        from docx_simple import RenderCancelled
+        self._cancel_event = None
+        if isinstance(error, RenderCancelled):
+            self._finish_generation()
+            self.log("⏹ Генерация отменена")
+            return
+        if error is not None:
+            self._finish_generation()
+            self.log(f"❗ Ошибка: {error}")
+            return
+        for path, result in zip(paths, results):
+            if result.unresolved:
+                self.log(f"⚠ {os.path.basename(path)}: не заполнены плейсхолдеры: "
+                         + ", ".join("{" + k + "}" for k in result.unresolved))
+            self.log(f"✅ Сохранено: {path}" + (" (из кэша)" if result.cached else ""))
+            if result.timings:
+                self.log(f"Сжатие {result.profile}: " + ", ".join(
+                    f"{stage} {sec * 1000:.0f} мс" for stage, sec in result.timings.items()))
+        if not remember_dir:
+            self._finish_generation()
+            return
+        try:
+            with open(CONFIG_SAVE_DIR_FILE, 'w', encoding='utf-8') as f:
+                f.write(os.path.dirname(paths[0]))
+        except Exception:
+            pass
+        self._set_progress("share", 0, 1)
+        # даём кадру отрисовать этап "share" до вызова системного диалога
+        Clock.schedule_once(lambda dt: self._share(paths), 0)
+
+    def _share(self, paths):
+        # набор — одним ACTION_SEND_MULTIPLE; если не вышло, только основной файл:
+        # несколько sharing.share подряд открывают несколько диалогов, виден лишь последний
+        try:
+            with profiling.stage("share"):
+                if len(paths) == 1 or not share_files_android(paths):
+                    if len(paths) > 1:
+                        self.log(f"⚠ Отправить набор не удалось, отправляется только {os.path.basename(paths[0])};"
+                                 f" остальные файлы — в {os.path.dirname(paths[0])}")
+                    sharing = plyer_facade("sharing")
+                    if sharing:
+                        sharing.share(file_path=paths[0])
+        except Exception:
+            pass
+        self._finish_generation()
+
+    def search_registry(self):
+        registry = self._get_registry()
+        if registry is None:
+            return []
+        query = self.ids.registry_query.text
+        found = registry.search(query, limit=REGISTRY_SHOWN)
+        if not found:
+            self.log(f"🔎 В реестре ничего не найдено: {query}")
+        for record in found:
+            self.log("🔎 " + record.title())
+        return found
+
+    def reissue_from_registry(self):
+        # повторная выдача по записи реестра: расчёт из сохранённых данных, без разбора брифа
+        found = self.search_registry()
+        if len(found) != 1:
+            if found:
+                self.log("Уточните запрос до одной записи, например #номер")
+            return
+        record = found[0]
+        template_path = record.template_path
+        if not os.path.exists(template_path):
+            template_path = self.template_path
+        if not template_path or not os.path.exists(template_path):
+            self.log("❗ Шаблон не выбран")
+            return
+        self.log(f"↻ Повторная выдача #{record.id}")
+        self._generate(record.quote(), [template_path])
+
+    def _finish_generation(self):
+        self.busy = False
+        self.progress_value = 0
+        self.progress_text = ""
+        if profiling.ENABLED:
+            self._report_profile()
+
+    def _report_profile(self):
+        # CONTRACT_PROFILE=1: сводка этапов этой генерации в лог, всё за сессию — в profile.json
+        recs = profiling.records()
+        profiling.clear()
+        if not recs:
+            return
+        self._profile_records.extend(recs)
+        self.log("⏱ Профиль:")
+        for line in profiling.summary_lines(recs):
+            self.log("  " + line)
+        try:
+            path = os.path.join(App.get_running_app().user_data_dir, "profile.json")
+            profiling.export_json(path, self._profile_records, {"profile": DOCX_PROFILE})
+            self.log(f"  → {path}")
+        except Exception as e:
+            self.log(f"❗ Профиль не сохранён: {e}")
+
+    def _set_progress(self, stage, done, total):
+        if not self.busy:
+            return
+        lo, hi = GENERATION_STAGES[stage][1]
+        self.progress_value = lo + (hi - lo) * (done / total if total else 1)
+        self.progress_text = GENERATION_STAGES[stage][0]
+
+    def cancel_generation(self):
+        self._dialog_open = False
+        if self._cancel_event is not None:
+            self._cancel_event.set()
+        elif self.busy:
+            # рендер не идёт (например, завис системный диалог отправки) — просто снимаем блокировку
+            self._finish_generation()
+
+    def on_app_resume(self):
+        # вернулись из системного диалога: если выбор файла отменили, on_selection не придёт
+        self._dialog_open = False
 
 class ContractKivyApp(App):
     def build(self):
-        return Builder.load_file("main.kv")
+        startup_mark("imports")
+        # kv разбирается один раз за запуск; App не подгружает одноимённый .kv
+        # повторно, т.к. имя файла не совпадает с именем класса приложения
+        root = Builder.load_file("main.kv")
+        startup_mark("kv loaded")
+        return root
+
+    def on_start(self):
+        from kivy.core.window import Window
+
+        def first_frame(*_):
+            Window.unbind(on_flip=first_frame)
+            startup_mark("first frame")
+        Window.bind(on_flip=first_frame)
+
+    def on_resume(self):
+        self.root.on_app_resume()
+        return True
 
 if __name__ == "__main__":
     ContractKivyApp().run()
@@ -0,0 +1,148 @@
+# pricing.py — цены, комплекты, часы и предоплата по таблице правил (pricing_rules.json).
+#
+# Диапазоны цен комплектов и пороги часов лежат в отсортированных списках и ищутся
+# через bisect. quote_columns() считает сразу много заказов по столбцам (цены,
+# категории, альбомы…) — пересчёт сезона после смены цен без разбора брифов.
+# contract_logic (match_complect, get_hours, get_default_price, Quote) берёт всё отсюда.
+
+import json, os, threading
+from bisect import bisect_left, bisect_right
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pricing_rules.json")
+
+_rules = None
+_rules_lock = threading.Lock()
+
+
+class PricingRules:
+    """Таблица правил, разобранная для быстрого поиска."""
+
+    def __init__(self, rules):
+        complects = sorted(rules["complects"], key=lambda c: c["min"])
+        for prev, cur in zip(complects, complects[1:]):
+            if cur["min"] <= prev["max"]:
+                raise ValueError(f"Диапазоны комплектов пересекаются: {prev['name']} и {cur['name']}")
+        self._starts = [c["min"] for c in complects]
+        self._ends = [c["max"] for c in complects]
+        self._complects = [(c["name"], c["pages"]) for c in complects]
+        # комплект → (верхние границы по возрастанию, часы; часов на одно больше, чем границ)
+        self._hours = {}
+        for name, h in rules.get("hours", {}).items():
+            if len(h["hours"]) != len(h["up_to"]) + 1 or h["up_to"] != sorted(h["up_to"]):
+                raise ValueError(f"Битая таблица часов: {name}")
+            self._hours[name] = (h["up_to"], h["hours"])
+        # категория → [(слово комплекта, цена)] в порядке файла
+        self._default_prices = {cat: [(k.lower(), str(v)) for k, v in prices.items()]
+                                for cat, prices in rules.get("default_prices", {}).items()}
+        self.citata_surcharge = rules.get("citata_surcharge", 0)
+        self.prepay_share = rules.get("prepay_share", 0)
+        self.prepay_round = rules.get("prepay_round", 1) or 1
+
+    def complect(self, price, category):
+        """Цена альбома → (комплект, страниц) или (None, None)."""
+        try:
+            p = int(price)
+        except (TypeError, ValueError):
+            return None, None
+        i = bisect_right(self._starts, p) - 1
+        if i < 0 or p > self._ends[i]:
+            return None, None
+        name, pages = self._complects[i]
+        return name, pages.get(category, pages.get("*"))
+
+    def hours(self, album_count, complect):
+        try:
+            n = int(album_count)
+        except (TypeError, ValueError):
+            return ""
+        table = self._hours.get(complect)
+        if table is None:
+            return ""
+        up_to, hours = table
+        return hours[bisect_left(up_to, n)]
+
+    def default_price(self, komplekt, category):
+        if not komplekt or not category:
+            return ""
+        k = komplekt.lower()
+        for word, price in self._default_prices.get(category, ()):
+            if word in k:
+                return price
+        return ""
+
+    def price(self, base_price, citata_on):
+        return base_price + (self.citata_surcharge if (citata_on and base_price) else 0)
+
+    def default_prepay(self, total):
+        return int(total * self.prepay_share) // self.prepay_round * self.prepay_round
+
+    def prepay(self, total, prepay_text=""):
+        # введённая вручную предоплата важнее расчётной
+        if prepay_text:
+            try:
+                return int(prepay_text)
+            except (TypeError, ValueError):
+                pass
+        return self.default_prepay(total)
+
+    def quote_columns(self, prices, categories, albums, citata=None, prepay=None):
+        """Расчёт по столбцам одинаковой длины; citata/prepay — необязательные столбцы.
+
+        Возвращает dict столбцов: complect, pages, hours, price, total, prepay, rest.
+        Цена и число альбомов — как в брифе (строки или числа); непонятное — 0 / "".
+        """
+        n = len(prices)
+        citata = citata if citata is not None else (False,) * n
+        prepay = prepay if prepay is not None else ("",) * n
+        out = {k: [None] * n for k in ("complect", "pages", "hours", "price", "total", "prepay", "rest")}
+        oc, op, oh, opr, ot, opp, orr = (out[k] for k in
+                                         ("complect", "pages", "hours", "price", "total", "prepay", "rest"))
+        complect_memo = {}
+        for i in range(n):
+            key = (prices[i], categories[i])
+            found = complect_memo.get(key)
+            if found is None:
+                found = complect_memo[key] = self.complect(*key)
+            name, pages = found
+            base, count = _to_int(prices[i]), _to_int(albums[i])
+            price = self.price(base, citata[i])
+            total = price * count
+            pre = self.prepay(total, prepay[i])
+            oc[i], op[i] = name or "", pages or ""
+            oh[i] = self.hours(albums[i], name) if name else ""   # как get_hours: непонятное → ""
+            opr[i], ot[i], opp[i], orr[i] = price, total, pre, total - pre
+        return out
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def load_rules(path=RULES_FILE):
+    with open(path, "r", encoding="utf-8") as f:
+        return PricingRules(json.load(f))
+
+
+def rules():
+    """Правила из RULES_FILE; читаются один раз на процесс (reload_rules — перечитать)."""
+    global _rules
+    if _rules is None:
+        with _rules_lock:
+            if _rules is None:
+                _rules = load_rules()
+    return _rules
+
+
+def reload_rules(path=RULES_FILE):
+    global _rules
+    new = load_rules(path)
+    with _rules_lock:
+        _rules = new
+    return new
+
+
+def quote_columns(prices, categories, albums, citata=None, prepay=None):
+    return rules().quote_columns(prices, categories, albums, citata, prepay)
@@ -0,0 +1,200 @@
+# profiling.py — необязательные замеры по этапам: время, байты, пик памяти.
+#
+#   CONTRACT_PROFILE=1     время этапов, прочитано/записано байт, память процесса
+#   CONTRACT_PROFILE=mem   то же + прирост пика памяти Python на этапе (tracemalloc, медленнее)
+#
+# Точные числа — время и байты (этапы считают их сами). Память — приблизительно:
+#   rss_delta_kb  изменение текущего RSS за этап; сюда попадают и другие потоки,
+#                 а освобождённое аллокатор не всегда отдаёт системе;
+#   rss_peak_kb   пик RSS процесса за всё время работы (ru_maxrss), не этапа;
+#   py_peak_kb    насколько пик tracemalloc за этап превысил память на входе в этап;
+#                 tracemalloc общий на процесс, поэтому у одновременных этапов из
+#                 разных потоков пики включают чужие выделения.
+#
+# Выключено по умолчанию; тогда stage() — общий пустой контекст, почти без затрат.
+# Этапы размечены в contract_logic (parse, pricing, quote), docx_simple (template_load,
+# substitute, compress, pack, cache_fetch) и main.py (generate, share).
+# Сводка — summary_lines(), выгрузка для сбора с разных устройств — export_json().
+
+import json, os, platform, threading, time
+from collections import deque
+from contextlib import nullcontext
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+MAX_RECORDS = 2000
+_PAGE_KB = (os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096) // 1024
+
+_mode = os.environ.get("CONTRACT_PROFILE", "").strip().lower()
+ENABLED = _mode not in ("", "0", "off", "false")
+TRACE_MEMORY = _mode == "mem"
+
+_records = deque(maxlen=MAX_RECORDS)
+_lock = threading.Lock()
+_active = []          # открытые этапы с tracemalloc — им передаётся пик перед reset_peak
+_trace_lock = threading.Lock()
+
+
+class Stage:
+    """Один замер; bytes_read/bytes_written этап дописывает сам через add()."""
+
+    __slots__ = ("name", "bytes_read", "bytes_written", "_t0", "_rss0", "_py0", "_py_peak")
+
+    def __init__(self, name):
+        self.name = name
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._py0 = None   # память tracemalloc на входе, если он был включён
+
+    def add(self, read=0, written=0):
+        self.bytes_read += read
+        self.bytes_written += written
+
+    def __enter__(self):
+        if TRACE_MEMORY:
+            import tracemalloc
+            with _trace_lock:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                # reset_peak общий: сначала отдаём накопленный пик уже открытым этапам
+                _fold_peak(tracemalloc)
+                tracemalloc.reset_peak()
+                self._py0 = self._py_peak = tracemalloc.get_traced_memory()[0]
+                _active.append(self)
+        self._rss0 = _rss_kb()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._t0
+        record = {
+            "stage": self.name,
+            "wall": wall,
+            "read": self.bytes_read,
+            "written": self.bytes_written,
+            "rss_delta_kb": _rss_kb() - self._rss0,
+            "rss_peak_kb": _rss_peak_kb(),
+            "ok": exc_type is None,
+            "thread": threading.current_thread().name,
+            "at": time.time(),
+        }
+        if self._py0 is not None:
+            import tracemalloc
+            with _trace_lock:
+                _fold_peak(tracemalloc)
+                _active.remove(self)
+            record["py_peak_kb"] = (self._py_peak - self._py0) // 1024
+        with _lock:
+            _records.append(record)
+        return False
+
+
+def _fold_peak(tracemalloc):
+    # под _trace_lock: пик с последнего reset_peak — в каждый открытый этап
+    peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+    for s in _active:
+        s._py_peak = max(s._py_peak, peak)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def add(self, read=0, written=0):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+_NULL = nullcontext(_NULL_STAGE)
+
+
+def stage(name):
+    """with stage("pack") as s: ...; s.add(written=n). Выключено — пустой контекст."""
+    if not ENABLED:
+        return _NULL
+    return Stage(name)
+
+
+def enable(on=True, trace_memory=False):
+    # переключатель из настроек приложения (вместо переменной окружения)
+    global ENABLED, TRACE_MEMORY
+    ENABLED, TRACE_MEMORY = bool(on), bool(on and trace_memory)
+
+
+def _rss_kb():
+    # текущий RSS: /proc есть на Linux и Android; иначе — пик процесса, тогда дельта ≈ 0
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_KB
+    except (OSError, ValueError, IndexError):
+        return _rss_peak_kb()
+
+
+def _rss_peak_kb():
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if platform.system() == "Darwin" else peak   # macOS — байты, Linux — КБ
+
+
+def records():
+    with _lock:
+        return list(_records)
+
+
+def clear():
+    with _lock:
+        _records.clear()
+
+
+def summary(recs=None):
+    """этап → {count, errors, total, max, read, written, rss_delta_kb, rss_peak_kb[, py_peak_kb]};
+    rss_delta_kb и py_peak_kb — наибольшие за этап (см. шапку модуля)."""
+    out = {}
+    for r in records() if recs is None else recs:
+        s = out.setdefault(r["stage"], {"count": 0, "errors": 0, "total": 0.0, "max": 0.0,
+                                         "read": 0, "written": 0, "rss_delta_kb": 0, "rss_peak_kb": 0})
+        s["count"] += 1
+        s["errors"] += not r["ok"]
+        s["total"] += r["wall"]
+        s["max"] = max(s["max"], r["wall"])
+        s["read"] += r["read"]
+        s["written"] += r["written"]
+        s["rss_delta_kb"] = max(s["rss_delta_kb"], r.get("rss_delta_kb", 0))
+        s["rss_peak_kb"] = max(s["rss_peak_kb"], r["rss_peak_kb"])
+        if "py_peak_kb" in r:
+            s["py_peak_kb"] = max(s.get("py_peak_kb", 0), r["py_peak_kb"])
+    return out
+
+
+def summary_lines(recs=None):
+    lines = []
+    for name, s in summary(recs).items():
+        line = f"{name}: {s['count']}× {s['total'] * 1000:.0f} мс (макс {s['max'] * 1000:.0f})"
+        if s["read"] or s["written"]:
+            line += f", ↓{s['read'] // 1024} КБ ↑{s['written'] // 1024} КБ"
+        line += f", RSS ~+{s['rss_delta_kb'] // 1024} МБ (пик процесса {s['rss_peak_kb'] // 1024} МБ)"
+        if "py_peak_kb" in s:
+            line += f", Python ~+{s['py_peak_kb']} КБ"
+        lines.append(line)
+    return lines
+
+
+def export_json(path, recs=None, extra=None):
+    """Пишет записи (по умолчанию — все накопленные) и сводку в JSON;
+    extra — метаданные (модель устройства, версия)."""
+    recs = records() if recs is None else recs
+    doc = {
+        "device": {"platform": platform.platform(), "machine": platform.machine(),
+                   "python": platform.python_version(), **(extra or {})},
+        "exported": time.time(),
+        "summary": summary(recs),
+        "records": recs,
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(doc, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+    return path
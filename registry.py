@@ -0,0 +1,183 @@
+# registry.py — реестр выданных договоров (SQLite).
+#
+# На каждый сформированный файл (у набора шаблонов — на каждый: договор, счёт, акт) —
+# запись: разобранный бриф (brief_data), поля формы (входы Quote), значения
+# плейсхолдеров, шаблон и путь к файлу. Поиск — по индексам: номер учреждения, класс,
+# телефон (последние 10 цифр, все номера брифа), дата выдачи. Повторная выдача строит
+# Quote из записи — бриф заново не разбирается.
+
+import json, os, re, sqlite3, threading, time
+from datetime import datetime
+
+from contract_logic import Quote, extract_phones
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contracts (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    day TEXT NOT NULL,               -- YYYY-MM-DD
+    institution TEXT NOT NULL,       -- номер учреждения
+    klass TEXT NOT NULL,             -- класс / группа, в нижнем регистре
+    file_name TEXT NOT NULL,
+    template_path TEXT NOT NULL,
+    out_path TEXT NOT NULL,
+    data TEXT NOT NULL,              -- brief_data, JSON
+    inputs TEXT NOT NULL,            -- поля формы (входы Quote кроме data), JSON
+    contract_values TEXT NOT NULL    -- значения плейсхолдеров, JSON
+);
+CREATE INDEX IF NOT EXISTS contracts_institution ON contracts (institution, klass);
+CREATE INDEX IF NOT EXISTS contracts_klass ON contracts (klass);
+CREATE INDEX IF NOT EXISTS contracts_day ON contracts (day);
+CREATE TABLE IF NOT EXISTS phones (
+    phone TEXT NOT NULL,             -- последние 10 цифр
+    contract_id INTEGER NOT NULL REFERENCES contracts (id) ON DELETE CASCADE,
+    PRIMARY KEY (phone, contract_id)
+) WITHOUT ROWID;
+"""
+
+_ID_RE = re.compile(r'^#(\d+)$')
+_ISO_DAY_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})$')
+_RU_DAY_RE = re.compile(r'^(\d{1,2})\.(\d{1,2})\.(\d{4})$')
+_PHONE_QUERY_RE = re.compile(r'^\+?[\d\s()-]{10,}$')
+_CLASS_QUERY_RE = re.compile(r'^\d+\s*[А-Яа-яA-Za-zЁё"«»]')
+
+
+class Record:
+    """Запись реестра; quote() — расчёт договора из сохранённых данных, без разбора брифа."""
+
+    __slots__ = ("id", "created", "institution", "klass", "file_name", "template_path",
+                 "out_path", "data", "inputs", "values")
+
+    def __init__(self, row):
+        (self.id, self.created, self.institution, self.klass, self.file_name, self.template_path,
+         self.out_path, data, inputs, values) = row
+        self.data = json.loads(data)
+        self.inputs = json.loads(inputs)
+        self.values = json.loads(values)
+
+    def quote(self, **changes):
+        # changes — правки полей формы поверх сохранённых (например, новая дата)
+        return Quote(self.data, **dict(self.inputs, **changes))
+
+    def title(self):
+        d = self.data
+        when = datetime.fromtimestamp(self.created).strftime("%d.%m.%Y")
+        inst = f"{d.get('тип_учреждения', '')} №{self.institution}".strip()
+        # имя файла различает записи одного набора (договор, счёт, акт)
+        return (f"#{self.id} {when} {inst} {d.get('класс', '')} {d.get('телефон', '')}".strip()
+                + f" — {os.path.basename(self.out_path)}")
+
+
+_COLUMNS = ("id, created, institution, klass, file_name, template_path, out_path, "
+            "data, inputs, contract_values")
+
+
+class Registry:
+    """Реестр в файле SQLite; методы можно вызывать из любого потока."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def add(self, quote, template_path, out_path, created=None):
+        """Записывает выданный договор (Quote, по которому он собран). Возвращает id."""
+        created = time.time() if created is None else created
+        d = quote.data
+        inputs = {name: getattr(quote, name) for name in Quote.INPUTS if name != "data"}
+        row = (created, datetime.fromtimestamp(created).strftime("%Y-%m-%d"),
+               str(d.get("номер_учреждения", "")), _norm_class(d.get("класс", "")),
+               quote.file_name, os.path.abspath(template_path), os.path.abspath(out_path),
+               json.dumps(d, ensure_ascii=False), json.dumps(inputs, ensure_ascii=False),
+               json.dumps(quote.values(), ensure_ascii=False))
+        phones = {_norm_phone(p) for p in extract_phones(str(d.get("телефон", "")))} - {""}
+        with self._lock, self._db:
+            cur = self._db.execute(
+                "INSERT INTO contracts (created, day, institution, klass, file_name, template_path,"
+                " out_path, data, inputs, contract_values) VALUES (?,?,?,?,?,?,?,?,?,?)", row)
+            self._db.executemany("INSERT OR IGNORE INTO phones VALUES (?, ?)",
+                                 [(p, cur.lastrowid) for p in phones])
+        return cur.lastrowid
+
+    def get(self, record_id):
+        with self._lock:
+            row = self._db.execute(f"SELECT {_COLUMNS} FROM contracts WHERE id = ?", (record_id,)).fetchone()
+        return Record(row) if row else None
+
+    def find(self, institution=None, klass=None, phone=None, day_from=None, day_to=None, limit=50):
+        """Последние записи по условиям (все — через И); day_* — "YYYY-MM-DD" включительно."""
+        where, args = [], []
+        if institution:
+            where.append("institution = ?")
+            args.append(str(institution))
+        if klass:
+            where.append("klass = ?")
+            args.append(_norm_class(klass))
+        if phone:
+            where.append("id IN (SELECT contract_id FROM phones WHERE phone = ?)")
+            args.append(_norm_phone(phone))
+        if day_from:
+            where.append("day >= ?")
+            args.append(day_from)
+        if day_to:
+            where.append("day <= ?")
+            args.append(day_to)
+        sql = f"SELECT {_COLUMNS} FROM contracts"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(sql, args + [limit]).fetchall()
+        return [Record(r) for r in rows]
+
+    def search(self, text, limit=50):
+        """Поиск по строке из поля ввода: "#12", "12.05.2025" / "2025-05-12", телефон,
+        "3А" (класс), "5" (номер учреждения); несколько условий — через пробел или запятую."""
+        text = (text or "").strip()
+        m = _ID_RE.match(text)
+        if m:
+            record = self.get(int(m.group(1)))
+            return [record] if record else []
+        if _PHONE_QUERY_RE.match(text) and not _parse_day(text):
+            return self.find(phone=text, limit=limit)
+        crit = {}
+        for word in re.split(r'[\s,;]+', text):
+            if not word:
+                continue
+            day = _parse_day(word)
+            if day:
+                crit["day_from"] = crit["day_to"] = day
+            elif _CLASS_QUERY_RE.match(word):
+                crit["klass"] = word
+            elif word.lstrip("№").isdigit():
+                crit["institution"] = word.lstrip("№")
+            else:
+                return []
+        return self.find(limit=limit, **crit) if crit else self.find(limit=limit)
+
+
+def _norm_class(klass):
+    return re.sub(r'[\s"«»]', '', str(klass)).lower()
+
+
+def _norm_phone(phone):
+    digits = re.sub(r'\D', '', str(phone))
+    return digits[-10:] if len(digits) >= 10 else ""
+
+
+def _parse_day(word):
+    if _ISO_DAY_RE.match(word):
+        return word
+    m = _RU_DAY_RE.match(word)
+    if m:
+        return f"{m.group(3)}-{int(m.group(2)):02d}-{int(m.group(1)):02d}"
+    return None
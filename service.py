@@ -0,0 +1,291 @@
+# service.py — локальный HTTP-сервис: разбор брифа, расчёт и генерация договора без Kivy.
+#
+#   python service.py --template шаблон.docx [--template акт=акт.docx] [--port 8765] [--workers 4]
+#
+# Только стандартная библиотека (asyncio). По умолчанию слушает 127.0.0.1.
+#
+#   POST /parse     {"brief": "...", "institution": "..."}        → strict_parse_brief
+#   POST /quote     + fio, vk, prepay, pages, hours, citata        → данные, значения, имя файла
+#   POST /generate  то же + "template" (имя), "profile"           → готовый .docx
+#   GET  /metrics   счётчики и время ответа по маршрутам
+#   GET  /health
+#
+# Поля запроса — те же, что колонки batch.py. Шаблоны компилируются при старте и
+# остаются в кэше docx_simple; разбор и рендер идут в пуле потоков, одновременно —
+# не больше --concurrency заданий, остальные ждут своей очереди.
+
+import argparse, asyncio, json, os, sys, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote as url_quote
+
+from contract_logic import strict_parse_brief
+from batch import analyze_row, row_text, row_values
+import docx_simple
+
+MAX_BODY = 1024 * 1024
+READ_TIMEOUT = 10.0
+JOB_TIMEOUT = 60.0
+DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            408: "Request Timeout", 413: "Payload Too Large", 500: "Internal Server Error",
+            504: "Gateway Timeout"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Metrics:
+    """Время ответа по маршрутам: число запросов, ошибок, сумма и максимум (с)."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.in_flight = 0
+        self.routes = {}
+
+    def record(self, route, seconds, ok):
+        m = self.routes.setdefault(route, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+        m["count"] += 1
+        m["errors"] += not ok
+        m["total"] += seconds
+        m["max"] = max(m["max"], seconds)
+
+    def snapshot(self):
+        routes = {r: dict(m, avg=m["total"] / m["count"]) for r, m in self.routes.items()}
+        return {"uptime": time.time() - self.started, "in_flight": self.in_flight, "routes": routes}
+
+
+class ContractService:
+    """Обработчик запросов; шаблоны — {имя: путь}, первый — шаблон по умолчанию."""
+
+    def __init__(self, templates, workers=None, concurrency=None):
+        self.templates = dict(templates)
+        self.default_template = next(iter(self.templates), None)
+        workers = workers or min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="service")
+        self.limit = asyncio.Semaphore(concurrency or workers)
+        self.metrics = Metrics()
+        self.routes = {
+            ("POST", "/parse"): self.parse,
+            ("POST", "/quote"): self.quote,
+            ("POST", "/generate"): self.generate,
+            ("GET", "/metrics"): self.get_metrics,
+            ("GET", "/health"): self.health,
+        }
+        for path in self.templates.values():
+            docx_simple.load_template(path)
+
+    async def run_job(self, fn, *args):
+        # по таймауту ответ уходит сразу, но поток ещё работает: место в очереди
+        # освобождается только когда задание действительно закончится
+        await self.limit.acquire()
+        try:
+            job = asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        except BaseException:
+            self.limit.release()
+            raise
+        job.add_done_callback(self._job_done)
+        return await asyncio.wait_for(asyncio.shield(job), JOB_TIMEOUT)
+
+    def _job_done(self, job):
+        self.limit.release()
+        if not job.cancelled():
+            job.exception()   # ошибку после таймаута уже некому забрать
+
+    # --- маршруты: (статус, тип, тело[, доп. заголовки]) ---
+
+    async def parse(self, body):
+        row = _json_body(body)
+        brief, institution = _text(row, "brief"), _text(row, "institution").strip()
+        if not brief.strip():
+            raise HttpError(400, "пустой бриф")
+        data = await self.run_job(strict_parse_brief, brief,
+                                  None if institution in ("", "Авто") else institution)
+        return _json(data)
+
+    async def quote(self, body):
+        row = _json_body(body)
+        data, values, name = await self.run_job(_quote_row, row)
+        return _json({"data": data, "values": values, "file_name": name})
+
+    async def generate(self, body):
+        row = _json_body(body)
+        template = self.templates.get(_text(row, "template") or self.default_template)
+        if template is None:
+            raise HttpError(404, "нет такого шаблона")
+        profile = _text(row, "profile") or docx_simple.DEFAULT_PROFILE
+        if profile not in docx_simple.COMPRESSION_PROFILES:
+            raise HttpError(400, f"неизвестный профиль сжатия: {profile}")
+        name, unresolved, payload = await self.run_job(_render_row, template, row, profile)
+        headers = {"Content-Disposition": "attachment; filename*=UTF-8''" + url_quote(name)}
+        if unresolved:
+            headers["X-Unresolved"] = url_quote(",".join(unresolved))
+        return 200, DOCX_TYPE, payload, headers
+
+    async def get_metrics(self, body):
+        return _json(self.metrics.snapshot())
+
+    async def health(self, body):
+        return _json({"ok": True, "templates": sorted(self.templates)})
+
+    # --- HTTP ---
+
+    async def handle(self, reader, writer):
+        t0 = time.perf_counter()
+        route, status = None, 500
+        self.metrics.in_flight += 1
+        try:
+            try:
+                method, path, body = await asyncio.wait_for(_read_request(reader), READ_TIMEOUT)
+                # метрики — только по известным маршрутам, остальное в одну корзину
+                route = path if any(p == path for _, p in self.routes) else "other"
+                handler = self.routes.get((method, path))
+                if handler is None:
+                    if route != "other":
+                        raise HttpError(405, "метод не поддерживается")
+                    raise HttpError(404, "нет такого маршрута")
+                status, ctype, payload, *extra = await handler(body)
+                headers = extra[0] if extra else {}
+            except HttpError as e:
+                status, ctype, payload, headers = _error(e.status, str(e))
+            except asyncio.IncompleteReadError:
+                status, ctype, payload, headers = _error(400, "тело запроса короче Content-Length")
+            except asyncio.TimeoutError:
+                status, ctype, payload, headers = _error(408 if route is None else 504, "таймаут")
+            except Exception as e:
+                status, ctype, payload, headers = _error(400 if isinstance(e, ValueError) else 500, str(e))
+            await _write_response(writer, status, ctype, payload, headers)
+        except ConnectionError:
+            pass
+        finally:
+            self.metrics.in_flight -= 1
+            if route is not None:
+                self.metrics.record(route, time.perf_counter() - t0, status < 400)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _quote_row(row):
+    data = analyze_row(row)
+    values, name = row_values(row, data)
+    return data, values, name
+
+
+def _render_row(template, row, profile):
+    # рендер во временный файл и обратно в байты; файл на диске сервису не нужен
+    values, name = row_values(row, analyze_row(row))
+    fd, tmp = tempfile.mkstemp(suffix=".docx")
+    os.close(fd)
+    try:
+        result = docx_simple.replace_in_docx(template, tmp, values, profile=profile)
+        with open(tmp, "rb") as f:
+            return name, result.unresolved, f.read()
+    finally:
+        os.unlink(tmp)
+
+
+def _json_body(body):
+    try:
+        row = json.loads(body or b"{}")
+    except ValueError:
+        raise HttpError(400, "тело запроса — не JSON") from None
+    if not isinstance(row, dict):
+        raise HttpError(400, "ожидается JSON-объект")
+    return row
+
+
+def _text(row, key):
+    try:
+        return row_text(row, key)
+    except ValueError as e:
+        raise HttpError(400, str(e)) from None
+
+
+def _json(data, status=200):
+    return status, "application/json; charset=utf-8", json.dumps(data, ensure_ascii=False).encode("utf-8"), {}
+
+
+def _error(status, message):
+    return _json({"error": message}, status)
+
+
+async def _read_request(reader):
+    line = await reader.readline()
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise HttpError(400, "битая строка запроса")
+    method, target, _ = parts
+    length = 0
+    while True:
+        header = await reader.readline()
+        if header in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = header.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            try:
+                length = int(value)
+            except ValueError:
+                raise HttpError(400, "битый Content-Length") from None
+    if length > MAX_BODY:
+        raise HttpError(413, "слишком большое тело запроса")
+    body = await reader.readexactly(length) if length > 0 else b""
+    return method.upper(), target.split("?", 1)[0], body
+
+
+async def _write_response(writer, status, ctype, payload, headers):
+    head = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", f"Content-Type: {ctype}",
+            f"Content-Length: {len(payload)}", "Connection: close"]
+    head += [f"{k}: {v}" for k, v in headers.items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+    await writer.drain()
+
+
+def parse_templates(items):
+    # "путь" или "имя=путь"; имя по умолчанию — имя файла без расширения
+    templates = {}
+    for item in items:
+        name, sep, path = item.partition("=")
+        if not sep:
+            name, path = os.path.splitext(os.path.basename(item))[0], item
+        templates[name] = path
+    return templates
+
+
+async def serve(host, port, templates, workers=None, concurrency=None):
+    service = ContractService(templates, workers, concurrency)
+    server = await asyncio.start_server(service.handle, host, port)
+    addr = server.sockets[0].getsockname()
+    print(f"Сервис договоров: http://{addr[0]}:{addr[1]} (шаблоны: {', '.join(templates) or 'нет'})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Локальный HTTP-сервис разбора брифов и генерации договоров")
+    ap.add_argument("--template", action="append", default=[], help="шаблон .docx или имя=путь; можно несколько")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=None, help="потоков для разбора и рендера")
+    ap.add_argument("--concurrency", type=int, default=None, help="одновременных заданий (по умолчанию = потокам)")
+    args = ap.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, parse_templates(args.template), args.workers, args.concurrency))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())